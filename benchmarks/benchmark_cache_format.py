@@ -0,0 +1,135 @@
+"""
+Benchmark of the cache formats of `chainerex.utils.cache`.
+
+Write time, read time and file size are measured for each format on the
+synthetic sparse feature matrix, whose non-zero rate is `--density`.
+
+Usage:
+    python benchmark_cache_format.py --rows 100000 --cols 200 --density 0.05
+"""
+from __future__ import print_function
+
+import argparse
+import functools
+import os
+import shutil
+import tempfile
+from time import time
+
+import numpy
+import pandas
+
+from chainerex.utils import cache
+
+
+def create_data(rows, cols, density, seed=0):
+    rs = numpy.random.RandomState(seed)
+    x = rs.rand(rows, cols).astype(numpy.float32)
+    x[rs.rand(rows, cols) >= density] = 0.
+    t = rs.randint(0, 10, size=rows).astype(numpy.int32)
+    return x, t
+
+
+def get_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f))
+                   for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def materialize(datasets):
+    # Force to read all the data, e.g. memory-map or lazy loading.
+    if isinstance(datasets, (list, tuple)):
+        return [numpy.array(d) for d in datasets]
+    return numpy.array(datasets)
+
+
+def get_formats(complevel):
+    """Returns list of (name, extension, save_fn, load_fn, use_pandas)"""
+    formats = [
+        ('npz', '.npz', cache.save_npz, cache.load_npz, False),
+        ('npz_compressed', '.npz',
+         functools.partial(cache.save_npz, compress=True), cache.load_npz,
+         False),
+        ('npy_dir', '', cache.save_npy_dir, cache.load_npy_dir, False),
+        ('hdf5', '.h5', cache.save_pandas_hdf5, cache.load_pandas_hdf5,
+         True),
+    ]
+    for complib in ['zlib', 'blosc', 'blosc:lz4']:
+        formats.append(
+            ('hdf5_{}_{}'.format(complib, complevel), '.h5',
+             functools.partial(cache.save_pandas_hdf5, complib=complib,
+                               complevel=complevel),
+             cache.load_pandas_hdf5, True))
+    return formats
+
+
+def benchmark(name, filepath, save_fn, load_fn, datasets, repeat):
+    write_times = []
+    read_times = []
+    for _ in range(repeat):
+        if os.path.exists(filepath):
+            cache._remove_cache(filepath)
+        t = time()
+        save_fn(filepath, datasets)
+        write_times.append(time() - t)
+
+        t = time()
+        materialize(load_fn(filepath))
+        read_times.append(time() - t)
+    return {'format': name,
+            'write_sec': min(write_times),
+            'read_sec': min(read_times),
+            'size_mb': get_size(filepath) / 1024. / 1024.}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of chainerex.utils.cache formats')
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='Number of rows of synthetic data')
+    parser.add_argument('--cols', type=int, default=200,
+                        help='Number of columns of synthetic data')
+    parser.add_argument('--density', type=float, default=0.05,
+                        help='Non-zero rate of synthetic data')
+    parser.add_argument('--complevel', type=int, default=5,
+                        help='Compression level of HDF5 formats')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of repeat, best time is reported')
+    parser.add_argument('--out', '-o', default=None,
+                        help='Directory to write files. Specify the '
+                             'directory on the target storage, e.g. NFS. '
+                             'Temporary directory is used by default.')
+    args = parser.parse_args()
+
+    x, t = create_data(args.rows, args.cols, args.density)
+    df_datasets = (pandas.DataFrame(x), pandas.Series(t))
+    print('data: x {} {}, t {} {}, density {}'.format(
+        x.shape, x.dtype, t.shape, t.dtype, args.density))
+
+    out_dir = tempfile.mkdtemp(dir=args.out)
+    results = []
+    try:
+        for name, ext, save_fn, load_fn, use_pandas in get_formats(
+                args.complevel):
+            datasets = df_datasets if use_pandas else (x, t)
+            filepath = os.path.join(out_dir, 'data_{}{}'.format(
+                name.replace(':', '_'), ext))
+            try:
+                results.append(benchmark(name, filepath, save_fn, load_fn,
+                                         datasets, args.repeat))
+            except (ImportError, ValueError) as e:
+                # e.g. compression library is not available
+                print('[WARNING] {} skipped: {}'.format(name, e))
+    finally:
+        shutil.rmtree(out_dir)
+
+    print('{:>20} {:>10} {:>10} {:>10}'.format(
+        'format', 'write[s]', 'read[s]', 'size[MB]'))
+    for r in results:
+        print('{:>20} {:>10.4f} {:>10.4f} {:>10.2f}'.format(
+            r['format'], r['write_sec'], r['read_sec'], r['size_mb']))
+
+
+if __name__ == '__main__':
+    main()
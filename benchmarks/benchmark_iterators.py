@@ -0,0 +1,191 @@
+"""
+Benchmark of the iterators of `chainerex.iterators`.
+
+Batches/sec, latency of each batch and peak memory are measured for each
+iterator on the synthetic datasets of several sizes, label skews and
+example costs. Label skew is the ratio of the count of the most frequent
+label to the least frequent one, and example cost is the time in seconds
+to get one example.
+
+Peak memory is the peak of the memory allocated by python and numpy in the
+main process, which is traced by `tracemalloc`. Since tracing slows down
+the allocation, it is measured by another iterator after the timed run,
+so that it does not affect batches/sec and latency. The memory of the worker
+processes of the multiprocess iterators is not included.
+
+Usage:
+    python benchmark_iterators.py --sizes 10000,100000 --skews 1,1000 \
+        --costs 0,0.0001
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import time
+import tracemalloc
+
+import numpy
+
+import chainer
+from chainer.datasets import TupleDataset
+
+from chainerex.iterators import BalancedSerialIterator
+from chainerex.iterators import MultiprocessBalancedIterator
+
+
+class CostlyDataset(chainer.dataset.DatasetMixin):
+
+    """Dataset which takes `cost` seconds to get each example"""
+
+    def __init__(self, x, t, cost):
+        self.x = x
+        self.t = t
+        self.cost = cost
+
+    def __len__(self):
+        return len(self.x)
+
+    def get_example(self, i):
+        time.sleep(self.cost)
+        return self.x[i], self.t[i]
+
+
+def create_dataset(size, skew, cost, n_labels=10, n_features=64, seed=0):
+    rs = numpy.random.RandomState(seed)
+    # label `k` is `skew ** (k / (n_labels - 1))` times rarer than label 0
+    weights = float(skew) ** (-numpy.arange(n_labels) /
+                              max(n_labels - 1, 1))
+    t = rs.choice(n_labels, size=size, p=weights / weights.sum())
+    t = t.astype(numpy.int32)
+    x = rs.rand(size, n_features).astype(numpy.float32)
+    if cost > 0:
+        return CostlyDataset(x, t, cost), t
+    return TupleDataset(x, t), t
+
+
+def get_iterators(n_processes):
+    """Returns list of (name, function to create iterator)"""
+    return [
+        ('serial', lambda d, t, b: chainer.iterators.SerialIterator(d, b)),
+        ('multiprocess',
+         lambda d, t, b: chainer.iterators.MultiprocessIterator(
+             d, b, n_processes=n_processes)),
+        ('balanced', lambda d, t, b: BalancedSerialIterator(
+            d, b, labels=t, seed=0)),
+        ('balanced_batch', lambda d, t, b: BalancedSerialIterator(
+            d, b, labels=t, batch_balancing=True, seed=0)),
+        ('multiprocess_balanced',
+         lambda d, t, b: MultiprocessBalancedIterator(
+             d, b, labels=t, n_processes=n_processes, seed=0)),
+    ]
+
+
+def measure_time(create_fn, dataset, labels, batch_size, n_batches, warmup):
+    t = time.time()
+    iterator = create_fn(dataset, labels, batch_size)
+    init_sec = time.time() - t
+    try:
+        for _ in range(warmup):
+            iterator.next()
+        latencies = []
+        t_start = time.time()
+        for _ in range(n_batches):
+            t = time.time()
+            iterator.next()
+            latencies.append(time.time() - t)
+        total_sec = time.time() - t_start
+    finally:
+        if hasattr(iterator, 'finalize'):
+            iterator.finalize()
+    return init_sec, total_sec, latencies
+
+
+def measure_peak_memory(create_fn, dataset, labels, batch_size, n_batches):
+    tracemalloc.start()
+    iterator = None
+    try:
+        iterator = create_fn(dataset, labels, batch_size)
+        for _ in range(n_batches):
+            iterator.next()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if hasattr(iterator, 'finalize'):
+            iterator.finalize()
+    return peak
+
+
+def benchmark(create_fn, dataset, labels, batch_size, n_batches, warmup):
+    init_sec, total_sec, latencies = measure_time(
+        create_fn, dataset, labels, batch_size, n_batches, warmup)
+    peak = measure_peak_memory(create_fn, dataset, labels, batch_size,
+                               warmup + n_batches)
+    latencies = numpy.array(latencies) * 1000.
+    return {'init_sec': init_sec,
+            'batches_per_sec': n_batches / total_sec,
+            'p50_ms': numpy.percentile(latencies, 50),
+            'p90_ms': numpy.percentile(latencies, 90),
+            'p99_ms': numpy.percentile(latencies, 99),
+            'max_ms': latencies.max(),
+            'peak_mb': peak / 1024. / 1024.}
+
+
+def parse_list(value, type_fn):
+    return [type_fn(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of chainerex.iterators')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='Comma separated dataset sizes')
+    parser.add_argument('--skews', default='1,1000',
+                        help='Comma separated label skews')
+    parser.add_argument('--costs', default='0,0.0001',
+                        help='Comma separated example costs in seconds')
+    parser.add_argument('--iterators', default=None,
+                        help='Comma separated iterator names to run. All '
+                             'the iterators are run by default.')
+    parser.add_argument('--batchsize', '-b', type=int, default=128,
+                        help='Batch size')
+    parser.add_argument('--n-batches', type=int, default=100,
+                        help='Number of batches to measure')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='Number of batches before measurement')
+    parser.add_argument('--n-processes', type=int, default=4,
+                        help='Number of processes of multiprocess iterators')
+    args = parser.parse_args()
+
+    iterators = get_iterators(args.n_processes)
+    if args.iterators is not None:
+        names = parse_list(args.iterators, str)
+        iterators = [(name, fn) for name, fn in iterators if name in names]
+
+    results = []
+    for size, skew, cost in itertools.product(
+            parse_list(args.sizes, int), parse_list(args.skews, float),
+            parse_list(args.costs, float)):
+        dataset, labels = create_dataset(size, skew, cost)
+        print('[INFO] size {}, skew {}, cost {}, label counts {}'.format(
+            size, skew, cost, numpy.bincount(labels).tolist()))
+        for name, create_fn in iterators:
+            r = benchmark(create_fn, dataset, labels, args.batchsize,
+                          args.n_batches, args.warmup)
+            r.update({'iterator': name, 'size': size, 'skew': skew,
+                      'cost': cost})
+            results.append(r)
+
+    print('{:>22} {:>8} {:>6} {:>7} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8} '
+          '{:>8}'.format('iterator', 'size', 'skew', 'cost', 'init[s]',
+                         'batch/s', 'p50[ms]', 'p90[ms]', 'p99[ms]',
+                         'max[ms]', 'peak[MB]'))
+    for r in results:
+        print('{:>22} {:>8} {:>6g} {:>7g} {:>8.3f} {:>9.1f} {:>8.2f} '
+              '{:>8.2f} {:>8.2f} {:>8.2f} {:>8.1f}'.format(
+                  r['iterator'], r['size'], r['skew'], r['cost'],
+                  r['init_sec'], r['batches_per_sec'], r['p50_ms'],
+                  r['p90_ms'], r['p99_ms'], r['max_ms'], r['peak_mb']))
+
+
+if __name__ == '__main__':
+    main()
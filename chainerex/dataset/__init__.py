@@ -6,5 +6,7 @@ from chainerex.dataset.dataset_mixin_ex import DatasetMixinEXFeatureIndexer  # N
 from chainerex.dataset.indexers import indexer
 from chainerex.dataset.indexers.feature_indexer import BaseFeatureIndexer
 from chainerex.dataset.indexers.indexer import BaseIndexer  # NOQA
+from chainerex.dataset.indexers.indexer import ExtractByIndicesNotSupportedError  # NOQA
 from chainerex.dataset.indexers.indexer import ExtractBySliceNotSupportedError  # NOQA
+from chainerex.dataset.indexers.ragged_array import RaggedArray  # NOQA
 
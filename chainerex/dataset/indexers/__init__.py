@@ -1,4 +1,6 @@
 from chainerex.dataset.indexers.indexer import BaseIndexer  # NOQA
+from chainerex.dataset.indexers.indexer import ExtractByIndicesNotSupportedError  # NOQA
 from chainerex.dataset.indexers.indexer import ExtractBySliceNotSupportedError  # NOQA  from chainerex.dataset.indexers.indexer import seIndexer  # NOQA
 from chainerex.dataset.indexers.feature_indexer import BaseFeatureIndexer  # NOQA
 from chainerex.dataset.indexers.feature_indexer import install_features_indexer  # NOQA
+from chainerex.dataset.indexers.ragged_array import RaggedArray  # NOQA
@@ -1,3 +1,9 @@
+import functools
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+
 import six
 import numpy
 from logging import getLogger
@@ -12,6 +18,112 @@ from chainer.datasets.transform_dataset import TransformDataset
 from chainer.datasets.tuple_dataset import TupleDataset
 
 from chainerex.dataset.indexers.indexer import BaseIndexer, ExtractBySliceNotSupportedError  # NOQA
+from chainerex.dataset.indexers.indexer import ExtractByIndicesNotSupportedError  # NOQA
+from chainerex.dataset.indexers.ragged_array import RaggedArray
+from chainerex.utils.cache import NPY_DIR_MANIFEST, load_npy_dir, save_npy_dir  # NOQA
+
+FEATURE_COLUMNS_FILE = 'feature_columns.json'
+
+
+def _as_feature_array(res):
+    """Converts list of features to numpy array
+
+    Ragged numeric arrays are converted to `RaggedArray`, and other ragged
+    features are converted to numpy object array.
+    """
+    try:
+        feature = numpy.asarray(res)
+        if feature.dtype != object:
+            return feature
+    except ValueError:
+        # ragged sequences
+        pass
+    arrays = [numpy.asarray(r) for r in res]
+    if all(a.ndim >= 1 and a.dtype != object and
+           a.shape[1:] == arrays[0].shape[1:] for a in arrays):
+        return RaggedArray.from_list(arrays,
+                                     dtype=numpy.result_type(*arrays))
+    feature = numpy.empty(len(res), dtype=object)
+    feature[:] = res[:]
+    return feature
+
+
+# Global variable in the worker process, set by `_parallel_setup`
+_parallel_indexer = None
+
+
+def _parallel_setup(indexer):
+    global _parallel_indexer
+    _parallel_indexer = indexer
+
+
+def _extract_chunk(indexer, features, indices):
+    return [tuple([indexer.extract_feature(i, j) for j in features])
+            for i in indices]
+
+
+def _parallel_extract_chunk(args):
+    features, indices = args
+    return _extract_chunk(_parallel_indexer, features, indices)
+
+
+def _indices_to_slice(indices, length):
+    """Returns slice equivalent to `indices` if it is arange-like, or None
+
+    None is returned also when `indices` is out of ``[0, length)``, since
+    slice clips the out of bounds index silently.
+    """
+    if len(indices) == 0:
+        return None
+    if indices.min() < 0 or indices.max() >= length:
+        return None
+    if len(indices) == 1:
+        return slice(int(indices[0]), int(indices[0]) + 1)
+    step = indices[1] - indices[0]
+    if step <= 0 or numpy.any(numpy.diff(indices) != step):
+        return None
+    return slice(int(indices[0]), int(indices[-1]) + 1, int(step))
+
+
+def _save_columns(dirpath, features, columns):
+    """Saves columns by `save_npy_dir`, `RaggedArray` as values and offsets
+
+    Feature index of each column is also saved, so that the columns are not
+    reused for the other features.
+    """
+    kinds = []
+    arrays = []
+    for column in columns:
+        if isinstance(column, RaggedArray):
+            kinds.append('ragged')
+            arrays.extend([column.values, column.offsets])
+        else:
+            kinds.append('array')
+            arrays.append(column)
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    with open(os.path.join(dirpath, FEATURE_COLUMNS_FILE), 'w') as f:
+        json.dump({'features': [int(j) for j in features],
+                   'kinds': kinds}, f)
+    # manifest is written at last to mark the directory complete.
+    save_npy_dir(dirpath, arrays)
+
+
+def _load_columns(dirpath, mmap_mode):
+    """Returns list of feature index and list of columns"""
+    with open(os.path.join(dirpath, FEATURE_COLUMNS_FILE), 'r') as f:
+        meta = json.load(f)
+    kinds = meta['kinds']
+    arrays = load_npy_dir(dirpath, mmap_mode=mmap_mode)
+    if not isinstance(arrays, list):
+        arrays = [arrays]
+    columns = []
+    for kind in kinds:
+        if kind == 'ragged':
+            columns.append(RaggedArray(arrays.pop(0), arrays.pop(0)))
+        else:
+            columns.append(arrays.pop(0))
+    return meta['features'], columns
 
 
 class BaseFeatureIndexer(BaseIndexer):
@@ -27,13 +139,52 @@ class BaseFeatureIndexer(BaseIndexer):
 
     Note that the returned value will be numpy array, even though the
     dataset is initilized with other format (e.g. list).
+    Slice and arange-like index array return the view of the backing numpy
+    array when possible, so modifying the returned value may modify the
+    dataset. Ragged numeric features are returned as `RaggedArray`.
 
     """
 
+    # Parallel extraction setting, see `set_parallel`
+    _num_workers = 0
+    _parallel_mode = 'thread'
+    _chunk_size = None
+
     def __init__(self, dataset):
         super(BaseFeatureIndexer, self).__init__()
         self.dataset = dataset
 
+    def set_parallel(self, num_workers, mode='thread', chunk_size=None):
+        """Enables parallel extraction by `extract_feature`
+
+        When the feature is extracted by calling `extract_feature` for each
+        data (i.e., `extract_feature_by_slice` and
+        `extract_feature_by_indices` are not supported), indices are split
+        into chunks and extracted by the pool of `num_workers` workers. The
+        results are assembled in the order of indices.
+
+        Args:
+            num_workers (int): number of workers. Parallel extraction is
+                disabled when it is 0 or 1.
+            mode (str): 'thread' to use the thread pool, which is suitable
+                when `get_example` releases the GIL (e.g. file IO, image
+                decode by PIL or cv2). 'process' to use the process pool, in
+                this case this indexer and its dataset are copied to the
+                worker processes and extracted features are pickled.
+            chunk_size (int): number of data in each chunk. By default,
+                indices are split into 4 chunks per worker.
+
+        """
+        if mode not in ('thread', 'process'):
+            raise ValueError("mode must be 'thread' or 'process', got {}"
+                             .format(mode))
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError('chunk_size must be positive, got {}'
+                             .format(chunk_size))
+        self._num_workers = num_workers
+        self._parallel_mode = mode
+        self._chunk_size = chunk_size
+
     def features_length(self):
         """Returns length of features
 
@@ -66,6 +217,24 @@ class BaseFeatureIndexer(BaseIndexer):
 
         raise ExtractBySliceNotSupportedError
 
+    def extract_feature_by_indices(self, indices, j):
+        """Extracts `indices`-th data's `j`-th feature.
+
+        Here, `indices` is 1d numpy array of non-negative data index.
+        This method may be override to support efficient feature extraction,
+        e.g. by fancy indexing of numpy array.
+        If not override, `ExtractByIndicesNotSupportedError` is raised by
+        default, and in this case `extract_feature` is used instead.
+
+        Args:
+            indices (numpy.ndarray): indices of data to be extracted
+            j (int): `j`-th feature to be extracted
+
+        Returns: feature
+        """
+
+        raise ExtractByIndicesNotSupportedError
+
     def extract_feature(self, i, j):
         """Extracts `i`-th data's `j`-th feature
 
@@ -84,8 +253,7 @@ class BaseFeatureIndexer(BaseIndexer):
                 *feature_index.indices(self.features_length())
             )
         elif isinstance(feature_index, (list, numpy.ndarray)):
-            if isinstance(feature_index[0],
-                          (bool, numpy.bool, numpy.bool_)):
+            if isinstance(feature_index[0], (bool, numpy.bool_)):
                 if len(feature_index) != self.features_length():
                     raise ValueError('Feature index wrong length {} instead of'
                                      ' {}'.format(len(feature_index),
@@ -134,8 +302,7 @@ class BaseFeatureIndexer(BaseIndexer):
             ret = self._extract_feature(data_index, feature_index_list[0])
         else:
             self._extract_single_feature = False
-            ret = tuple([self._extract_feature(data_index, j) for j in
-                         feature_index_list])
+            ret = self._extract_features(data_index, feature_index_list)
         self.postprocess(item)
         return ret
 
@@ -144,6 +311,92 @@ class BaseFeatureIndexer(BaseIndexer):
             raise IndexError('index {} is out of bounds for axis 1 with '
                              'size {}'.format(j, self.features_length()))
 
+    def _is_vectorized(self, j):
+        """Returns True if `j`-th feature of many data is extracted at once
+
+        False means the feature may be extracted by `extract_feature` for
+        each data, e.g. calling `get_example` for each feature. By default,
+        it is True when `extract_feature_by_slice` or
+        `extract_feature_by_indices` is overridden.
+        """
+        cls = type(self)
+        return six.get_unbound_function(cls.extract_feature_by_slice) is \
+            not six.get_unbound_function(
+                BaseFeatureIndexer.extract_feature_by_slice) or \
+            six.get_unbound_function(cls.extract_feature_by_indices) is \
+            not six.get_unbound_function(
+                BaseFeatureIndexer.extract_feature_by_indices)
+
+    def _list_to_indices(self, data_index):
+        """Converts list or bool flags of data index to non-negative indices
+        """
+        if len(data_index) > 0 and \
+                isinstance(data_index[0], (bool, numpy.bool_)):
+            # Access by bool flag list
+            if len(data_index) != self.dataset_length():
+                raise ValueError('Feature index wrong length {} instead of'
+                                 ' {}'.format(len(data_index),
+                                              self.dataset_length()))
+            data_index = numpy.argwhere(data_index).ravel()
+
+        # it may contain negative value index, so convert them.
+        data_index = numpy.asarray(data_index, dtype=numpy.intp)
+        return numpy.where(data_index < 0,
+                           data_index + self.dataset_length(), data_index)
+
+    def _extract_features(self, data_index, feature_index_list):
+        """Extracts tuple of features of `feature_index_list`
+
+        The features which are not vectorized are extracted together from
+        each data by `_extract_features_by_rows`, so that each data is read
+        once (e.g. by one `get_example`) for all of them.
+
+        Args:
+            data_index (int, slice, list or numpy.ndarray):
+            feature_index_list (list): feature indices
+
+        """
+        for j in feature_index_list:
+            self.check_type_feature_index(j)
+        rows = [j for j in feature_index_list if not self._is_vectorized(j)]
+        values = {}
+        if len(rows) > 1:
+            if isinstance(data_index, slice):
+                indices = numpy.arange(
+                    *data_index.indices(self.dataset_length()))
+            elif isinstance(data_index, (list, numpy.ndarray)):
+                indices = self._list_to_indices(data_index)
+                if len(indices) == 1:
+                    # single data, same with `_extract_feature`
+                    indices = indices[0]
+            else:
+                # assuming data_index is int.
+                indices = data_index
+                if indices < 0:
+                    indices += self.dataset_length()
+            values = dict(zip(rows, self._extract_features_by_rows(indices,
+                                                                   rows)))
+        return tuple([values[j] if j in values else
+                      self._extract_feature(data_index, j)
+                      for j in feature_index_list])
+
+    def _extract_features_by_rows(self, indices, features):
+        """Extracts `features` of `indices` by reading each data once
+
+        Args:
+            indices (int or numpy.ndarray): non-negative data index, or 1d
+                array of them.
+            features (list): feature indices
+
+        Returns (list): feature of each `features`
+
+        """
+        if not isinstance(indices, numpy.ndarray):
+            return [self.extract_feature(indices, j) for j in features]
+        res = self._extract_feature_list(indices, features)
+        return [_as_feature_array([row[k] for row in res])
+                for k in six.moves.range(len(features))]
+
     def _extract_feature(self, data_index, j):
         """Format `data_index` and call proper method to extract feature.
 
@@ -159,37 +412,71 @@ class BaseFeatureIndexer(BaseIndexer):
             except ExtractBySliceNotSupportedError:
                 # Accessing by each index, copy occurs
                 current, stop, step = data_index.indices(self.dataset_length())
-                res = [self.extract_feature(i, j) for i in
-                       six.moves.range(current, stop, step)]
+                res = self._extract_feature_list(
+                    numpy.arange(current, stop, step), [j])
         elif isinstance(data_index, (list, numpy.ndarray)):
-            if isinstance(data_index[0], (bool, numpy.bool, numpy.bool_)):
-                # Access by bool flag list
-                if len(data_index) != self.dataset_length():
-                    raise ValueError('Feature index wrong length {} instead of'
-                                     ' {}'.format(len(data_index),
-                                                  self.dataset_length()))
-                data_index = numpy.argwhere(data_index).ravel()
-
-            # assuming data_index is list.
-            # it may contain negative value index, so convert them.
-            data_index = [self.dataset_length() + i if i < 0 else i
-                          for i in data_index]
+            data_index = self._list_to_indices(data_index)
             if len(data_index) == 1:
                 return self.extract_feature(data_index[0], j)
-            else:
-                res = [self.extract_feature(i, j) for i in data_index]
+            slice_index = _indices_to_slice(data_index,
+                                            self.dataset_length())
+            if slice_index is not None:
+                # contiguous indices are extracted as view if possible.
+                try:
+                    feature = self.extract_feature_by_slice(slice_index, j)
+                    if isinstance(feature, (numpy.ndarray, RaggedArray)):
+                        return feature
+                except ExtractBySliceNotSupportedError:
+                    pass
+            try:
+                return self.extract_feature_by_indices(data_index, j)
+            except ExtractByIndicesNotSupportedError:
+                # Accessing by each index, copy occurs
+                res = self._extract_feature_list(data_index, [j])
         else:
             # assuming data_index is int.
             # it may contain negative value index, so convert them.
             if data_index < 0:
                 data_index += self.dataset_length()
             return self.extract_feature(data_index, j)
+        return _as_feature_array([row[0] for row in res])
+
+    def _extract_feature_list(self, indices, features):
+        """Returns list of tuple of `features` by `extract_feature`
+
+        All the `features` of each data are extracted in the same chunk, so
+        that the data cached by `extract_feature` (e.g. `_cache_features` of
+        `DatasetMixin`) is reused also in the worker process.
+        """
+        num_workers = self._num_workers
+        if num_workers <= 1 or len(indices) <= 1:
+            return _extract_chunk(self, features, indices)
+        chunk_size = self._chunk_size or -(-len(indices) // (num_workers * 4))
+        chunks = [indices[i:i + chunk_size]
+                  for i in six.moves.range(0, len(indices), chunk_size)]
+        if self._parallel_mode == 'thread':
+            pool = multiprocessing.pool.ThreadPool(num_workers)
+            fn = functools.partial(_extract_chunk, self, features)
+            tasks = chunks
+        else:
+            pool = multiprocessing.Pool(num_workers,
+                                        initializer=_parallel_setup,
+                                        initargs=(self, ))
+            fn = _parallel_extract_chunk
+            tasks = [(features, chunk) for chunk in chunks]
         try:
-            feature = numpy.asarray(res)
-        except ValueError:
-            feature = numpy.empty(len(res), dtype=object)
-            feature[:] = res[:]
-        return feature
+            # `map` keeps the order of chunks
+            results = pool.map(fn, tasks, chunksize=1)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        res = []
+        for result in results:
+            res.extend(result)
+        return res
 
 
 class TupleDatasetEx(object):
@@ -234,9 +521,17 @@ class TupleDatasetFeatureIndexer(BaseFeatureIndexer):
     def features_length(self):
         return len(self.datasets)
 
+    def _is_vectorized(self, j):
+        return True
+
     def extract_feature_by_slice(self, slice_index, j):
         return self.datasets[j][slice_index]
 
+    def extract_feature_by_indices(self, indices, j):
+        if not isinstance(self.datasets[j], numpy.ndarray):
+            raise ExtractByIndicesNotSupportedError
+        return self.datasets[j][indices]
+
     def extract_feature(self, i, j):
         return self.datasets[j][i]
 
@@ -296,9 +591,17 @@ class DictDatasetFeaturesIndexer(BaseFeatureIndexer):
     def features_length(self):
         return len(self.datasets)
 
+    def _is_vectorized(self, j):
+        return True
+
     def extract_feature_by_slice(self, slice_index, j):
         return self.datasets[j][slice_index]
 
+    def extract_feature_by_indices(self, indices, j):
+        if not isinstance(self.datasets[j], numpy.ndarray):
+            raise ExtractByIndicesNotSupportedError
+        return self.datasets[j][indices]
+
     def extract_feature(self, i, j):
         return self.datasets[j][i]
 
@@ -342,9 +645,104 @@ class DatasetMixinFeatureIndexer(BaseFeatureIndexer):
     def features_length(self):
         return self.dataset.features_length()
 
+    def materialize(self, features=None, dirpath=None, mmap_mode='r'):
+        """Stores features as contiguous columns in `feature_cache`
+
+        All the examples are read by one pass of `get_example`, and each
+        feature is stored as one numpy array. After that, `features[:, j]`
+        of the materialized feature `j` is extracted from the array without
+        calling `get_example`. When only one feature is specified, it is
+        extracted by `extract_feature`, so that a light feature (e.g. label
+        of `LabeledImageDataset`) does not decode the heavy one.
+
+        Args:
+            features (int or list): feature indices to materialize. All the
+                features are materialized by default.
+            dirpath (str): If specified, columns are saved to this directory
+                by `save_npy_dir`, and loaded as memory-map. When the
+                directory is already saved, it is loaded without reading the
+                dataset, and ValueError is raised when it is saved for the
+                different `features`. Columns must not be object array in
+                this case, while `RaggedArray` is saved as its values and
+                offsets.
+            mmap_mode (str or None): `mmap_mode` to load columns from
+                `dirpath`.
+
+        Returns (dict): `feature_cache`, dict of feature index to column
+
+        """
+        if features is None:
+            features = slice(None)
+        features = self.create_feature_index_list(features)
+        if dirpath is not None and os.path.exists(
+                os.path.join(dirpath, NPY_DIR_MANIFEST)):
+            logger = getLogger(__name__)
+            logger.info('loading feature columns from {}'.format(dirpath))
+            saved_features, columns = _load_columns(dirpath, mmap_mode)
+            if saved_features != [int(j) for j in features]:
+                raise ValueError('{} is saved for features {}, but features '
+                                 '{} are specified.'.format(
+                                     dirpath, saved_features, features))
+        else:
+            if len(features) == 1:
+                columns = [self[:, features[0]]]
+            else:
+                columns = self._extract_columns(features)
+            if dirpath is not None:
+                _save_columns(dirpath, features, columns)
+                _, columns = _load_columns(dirpath, mmap_mode)
+        if len(columns) != len(features):
+            raise ValueError('{} columns are loaded for {} features'
+                             .format(len(columns), len(features)))
+        self.feature_cache = dict(zip(features, columns))
+        return self.feature_cache
+
+    def _extract_columns(self, features):
+        values = [[] for _ in features]
+        for i in six.moves.range(self.dataset_length()):
+            data = self.dataset.get_example(i)
+            if not isinstance(data, tuple):
+                data = (data, )
+            for value, j in zip(values, features):
+                value.append(data[j])
+        return [_as_feature_array(value) for value in values]
+
+    def _extract_feature(self, data_index, j):
+        if self.feature_cache is not None and j in self.feature_cache:
+            self.check_type_feature_index(j)
+            if isinstance(data_index, (list, numpy.ndarray)) and \
+                    len(data_index) > 0 and \
+                    not isinstance(data_index[0], (bool, numpy.bool_)):
+                data_index = numpy.asarray(data_index)
+                if len(data_index) == 1:
+                    # single data, same with `BaseFeatureIndexer`
+                    return self.feature_cache[j][data_index[0]]
+                slice_index = _indices_to_slice(data_index,
+                                                len(self.feature_cache[j]))
+                if slice_index is not None:
+                    # view of the column
+                    data_index = slice_index
+            # numpy indexing supports int, slice, list and bool mask.
+            return self.feature_cache[j][data_index]
+        return super(DatasetMixinFeatureIndexer, self)._extract_feature(
+            data_index, j)
+
+    def _is_vectorized(self, j):
+        if self.feature_cache is not None and j in self.feature_cache:
+            return True
+        # extraction by slice or indices is overridden by the dataset
+        cls = type(self.dataset)
+        return six.get_unbound_function(cls.extract_feature_by_slice) is \
+            not dm_extract_feature_by_slice or \
+            six.get_unbound_function(cls.extract_feature_by_indices) is \
+            not dm_extract_feature_by_indices
+
     def extract_feature_by_slice(self, slice_index, j):
         return self.dataset.extract_feature_by_slice(slice_index, j)
 
+    def extract_feature_by_indices(self, indices, j):
+        return self.dataset.extract_feature_by_indices(indices, j)
+
     def extract_feature(self, i, j):
         return self.dataset.extract_feature(i, j)
 
@@ -381,6 +779,22 @@ def dm_extract_feature_by_slice(self, slice_index, j):
     raise ExtractBySliceNotSupportedError
 
 
+def dm_extract_feature_by_indices(self, indices, j):
+    """This method may be override to support efficient feature extraction.
+
+    If not override, `ExtractByIndicesNotSupportedError` is raised by
+    default, and in this case `extract_feature` is used instead.
+
+    Args:
+        indices (numpy.ndarray): indices of data to be extracted
+        j (int): `j`-th feature to be extracted
+
+    Returns: feature
+
+    """
+    raise ExtractByIndicesNotSupportedError
+
+
 def dm_extract_feature(self, i, j):
     """Extracts `i`-th data's `j`-th feature
 
@@ -433,6 +847,363 @@ def dm_features(self):
     return self._features_indexer
 
 
+def _extract_rows(features, indices, j):
+    """Extracts `j`-th feature of `indices` by `features` as sequence
+
+    `features[indices, j]` returns one feature instead of the sequence when
+    `indices` has only one element, thus slice is used when possible.
+    """
+    slice_index = _indices_to_slice(indices, features.dataset_length())
+    if slice_index is not None:
+        return features[slice_index, j]
+    return features[indices, j]
+
+
+def _example_feature(data, j):
+    """Returns `j`-th feature of the example returned by `get_example`"""
+    if isinstance(data, tuple):
+        return data[j]
+    elif j == 0:
+        return data
+    else:
+        raise ValueError('[Error] unexpected behavior')
+
+
+def _example_dataset(dataset):
+    """Returns TupleDataset or DictDataset which builds examples of `dataset`
+
+    None is returned when the type of the example is not known without
+    calling `get_example`.
+    """
+    if isinstance(dataset, (TupleDataset, DictDataset)):
+        return dataset
+    elif isinstance(dataset, SubDataset):
+        return _example_dataset(dataset._dataset)
+    elif isinstance(dataset, ConcatenatedDataset):
+        bases = [_example_dataset(d) for d in dataset._datasets]
+        if all(b is not None for b in bases) and \
+                len(set(type(b) for b in bases)) == 1:
+            return bases[0]
+    return None
+
+
+def _concat_features(features_list):
+    """Concatenates features along axis 0"""
+    features_list = [f if isinstance(f, (numpy.ndarray, RaggedArray))
+                     else _as_feature_array(f) for f in features_list]
+    if len(features_list) == 1:
+        return features_list[0]
+    if all(isinstance(f, RaggedArray) for f in features_list):
+        values = numpy.concatenate([f.values for f in features_list])
+        offsets = [features_list[0].offsets]
+        for f in features_list[1:]:
+            offsets.append(f.offsets[1:] + offsets[-1][-1])
+        return RaggedArray(values, numpy.concatenate(offsets))
+    if not any(isinstance(f, RaggedArray) for f in features_list):
+        try:
+            return numpy.concatenate(features_list)
+        except ValueError:
+            # e.g. ragged feature which is not ragged in some of the list
+            pass
+    rows = []
+    for f in features_list:
+        rows.extend(f)
+    return _as_feature_array(rows)
+
+
+class SubDatasetFeatureIndexer(BaseFeatureIndexer):
+    """FeatureIndexer for SubDataset
+
+    Data index is converted to the index of the base dataset, and the
+    feature is extracted by the indexer of the base dataset.
+    """
+
+    def __init__(self, dataset):
+        """
+
+        Args:
+            dataset (SubDataset): SubDataset instance
+        """
+        if not isinstance(dataset, SubDataset):
+            raise TypeError('dataset class {} is not expected'
+                            .format(type(dataset)))
+        super(SubDatasetFeatureIndexer, self).__init__(dataset)
+        self.base_features = dataset._dataset.features
+
+    def features_length(self):
+        return self.base_features.features_length()
+
+    def check_type_feature_index(self, j):
+        self.base_features.check_type_feature_index(j)
+
+    def create_feature_index_list(self, feature_index):
+        return self.base_features.create_feature_index_list(feature_index)
+
+    def _is_vectorized(self, j):
+        return self.base_features._is_vectorized(j)
+
+    def _base_index(self, index):
+        # Check bounds same with `SubDataset.get_example`, not to access the
+        # base dataset out of this subset.
+        size = self.dataset_length()
+        index = numpy.asarray(index)
+        if index.size > 0 and (index.min() < -size or index.max() >= size):
+            raise IndexError('index {} is out of bounds for size {}'
+                             .format(index, size))
+        index = numpy.where(index < 0, index + size, index)
+        if index.ndim == 0:
+            index = int(index)
+        index = self.dataset._start + index
+        if self.dataset._order is not None:
+            index = self.dataset._order[index]
+        return index
+
+    def extract_feature_by_slice(self, slice_index, j):
+        start, stop, step = slice_index.indices(self.dataset_length())
+        if self.dataset._order is None:
+            if len(six.moves.range(start, stop, step)) == 0:
+                return self.extract_feature_by_indices(
+                    numpy.empty(0, dtype=numpy.intp), j)
+            # slice of the base dataset, which may be the view
+            base_start = self.dataset._start + start
+            base_stop = self.dataset._start + stop
+            if base_stop < 0:
+                # slice to the head of the base dataset with negative step
+                base_stop = None
+            return self.base_features[slice(base_start, base_stop, step), j]
+        return self.extract_feature_by_indices(
+            numpy.arange(start, stop, step), j)
+
+    def extract_feature_by_indices(self, indices, j):
+        return _extract_rows(self.base_features, self._base_index(indices), j)
+
+    def extract_feature(self, i, j):
+        return self.base_features[self._base_index(i), j]
+
+    def _extract_features_by_rows(self, indices, features):
+        # all the features are extracted by one access to the base indexer
+        index = self._base_index(indices)
+        if isinstance(index, numpy.ndarray):
+            slice_index = _indices_to_slice(
+                index, self.base_features.dataset_length())
+            if slice_index is not None:
+                index = slice_index
+        return list(self.base_features[index, features])
+
+
+class ConcatenatedDatasetFeatureIndexer(BaseFeatureIndexer):
+    """FeatureIndexer for ConcatenatedDataset
+
+    Data index is split for each dataset by its offset, and the feature is
+    extracted by the indexer of each dataset.
+    """
+
+    def __init__(self, dataset):
+        """
+
+        Args:
+            dataset (ConcatenatedDataset): ConcatenatedDataset instance
+        """
+        if not isinstance(dataset, ConcatenatedDataset):
+            raise TypeError('dataset class {} is not expected'
+                            .format(type(dataset)))
+        super(ConcatenatedDatasetFeatureIndexer, self).__init__(dataset)
+        self.base_features_list = [d.features for d in dataset._datasets]
+        self.offsets = numpy.cumsum(
+            [0] + [len(d) for d in dataset._datasets])
+
+    def features_length(self):
+        return self.base_features_list[0].features_length()
+
+    def check_type_feature_index(self, j):
+        self.base_features_list[0].check_type_feature_index(j)
+
+    def create_feature_index_list(self, feature_index):
+        return self.base_features_list[0].create_feature_index_list(
+            feature_index)
+
+    def _is_vectorized(self, j):
+        return all(features._is_vectorized(j)
+                   for features in self.base_features_list)
+
+    def extract_feature_by_slice(self, slice_index, j):
+        return self.extract_feature_by_indices(
+            numpy.arange(*slice_index.indices(self.dataset_length())), j)
+
+    def _extract_by_datasets(self, indices, extract_fn):
+        """Extracts list of features by `extract_fn` for each dataset
+
+        Args:
+            indices (numpy.ndarray): 1d array of data index
+            extract_fn (callable): function which takes the indexer of the
+                dataset and local indices, and returns list of features.
+
+        Returns (list): features concatenated in the order of `indices`
+
+        """
+        dataset_ids = numpy.searchsorted(self.offsets[1:], indices,
+                                         side='right')
+        # Extract features of each dataset in the order of dataset id
+        order = numpy.argsort(dataset_ids, kind='mergesort')
+        sorted_ids = dataset_ids[order]
+        sorted_indices = indices[order]
+        boundaries = numpy.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+        features_lists = []
+        for start, end in zip(numpy.concatenate([[0], boundaries]),
+                              numpy.concatenate([boundaries,
+                                                 [len(indices)]])):
+            if start == end:
+                continue
+            k = sorted_ids[start]
+            local_indices = sorted_indices[start:end] - self.offsets[k]
+            features_lists.append(extract_fn(self.base_features_list[k],
+                                             local_indices))
+        if len(features_lists) == 0:
+            return None
+        inverse = None
+        if numpy.any(order != numpy.arange(len(order))):
+            # restore the original order
+            inverse = numpy.empty_like(order)
+            inverse[order] = numpy.arange(len(order))
+        res = []
+        for features_list in zip(*features_lists):
+            feature = _concat_features(features_list)
+            if inverse is not None:
+                feature = feature[inverse]
+            res.append(feature)
+        return res
+
+    def extract_feature_by_indices(self, indices, j):
+        res = self._extract_by_datasets(
+            indices, lambda features, local_indices: [
+                _extract_rows(features, local_indices, j)])
+        if res is None:
+            return numpy.empty(0)
+        return res[0]
+
+    def _dataset_id(self, i):
+        k = int(numpy.searchsorted(self.offsets[1:], i, side='right'))
+        if k >= len(self.base_features_list):
+            raise IndexError('index {} is out of bounds for size {}'
+                             .format(i, self.dataset_length()))
+        return k
+
+    def extract_feature(self, i, j):
+        k = self._dataset_id(i)
+        return self.base_features_list[k][i - self.offsets[k], j]
+
+    def _extract_features_by_rows(self, indices, features):
+        # all the features are extracted by one access to each indexer
+        if not isinstance(indices, numpy.ndarray):
+            k = self._dataset_id(indices)
+            return list(self.base_features_list[k][indices - self.offsets[k],
+                                                   features])
+
+        def extract_fn(base_features, local_indices):
+            slice_index = _indices_to_slice(local_indices,
+                                            base_features.dataset_length())
+            if slice_index is not None:
+                local_indices = slice_index
+            return list(base_features[local_indices, features])
+
+        res = self._extract_by_datasets(indices, extract_fn)
+        if res is None:
+            return [numpy.empty(0) for _ in features]
+        return res
+
+
+class TransformDatasetFeatureIndexer(BaseFeatureIndexer):
+    """FeatureIndexer for TransformDataset
+
+    The features of the base dataset are extracted at once by its indexer
+    when it supports, and the transform is applied to each example built
+    from them. Otherwise each example of the base dataset is read once.
+    The transform is applied once for each data in one access, even when
+    several features are extracted.
+    """
+
+    def __init__(self, dataset):
+        """
+
+        Args:
+            dataset (TransformDataset): TransformDataset instance
+        """
+        if not isinstance(dataset, TransformDataset):
+            raise TypeError('dataset class {} is not expected'
+                            .format(type(dataset)))
+        super(TransformDatasetFeatureIndexer, self).__init__(dataset)
+        self.base_dataset = dataset._dataset
+        self.base_features = dataset._dataset.features
+
+    def features_length(self):
+        return self.dataset.features_length()
+
+    def _is_vectorized(self, j):
+        # transform is applied for each data
+        return False
+
+    def _base_examples(self, indices):
+        """Returns list of the examples of the base dataset"""
+        base = self.base_dataset
+        example_dataset = _example_dataset(base)
+        if isinstance(example_dataset, DictDataset):
+            keys = list(example_dataset._datasets.keys())
+        else:
+            keys = list(six.moves.range(self.base_features.features_length()))
+        if (example_dataset is None and len(keys) == 1) or \
+                not all(self.base_features._is_vectorized(k) for k in keys):
+            # Example type is unknown, or extracting each feature reads the
+            # whole example again.
+            return [base[int(i)] for i in indices]
+        columns = [_extract_rows(self.base_features, indices, k)
+                   for k in keys]
+        if isinstance(example_dataset, DictDataset):
+            return [dict(zip(keys, values))
+                    for values in six.moves.zip(*columns)]
+        return list(six.moves.zip(*columns))
+
+    def extract_feature_by_slice(self, slice_index, j):
+        return self.extract_feature_by_indices(
+            numpy.arange(*slice_index.indices(self.dataset_length())), j)
+
+    def extract_feature_by_indices(self, indices, j):
+        return self._extract_features_by_rows(indices, [j])[0]
+
+    def extract_feature(self, i, j):
+        return _example_feature(self.dataset.get_example(i), j)
+
+    def _extract_features_by_rows(self, indices, features):
+        if not isinstance(indices, numpy.ndarray):
+            data = self.dataset.get_example(indices)
+            return [_example_feature(data, j) for j in features]
+        examples = [self.dataset._transform(in_data)
+                    for in_data in self._base_examples(indices)]
+        return [_as_feature_array([_example_feature(data, j)
+                                   for data in examples])
+                for j in features]
+
+
+@property
+def sd_features(self):
+    if self._features_indexer is None:
+        self._features_indexer = SubDatasetFeatureIndexer(self)
+    return self._features_indexer
+
+
+@property
+def cd_features(self):
+    if self._features_indexer is None:
+        self._features_indexer = ConcatenatedDatasetFeatureIndexer(self)
+    return self._features_indexer
+
+
+@property
+def trd_features(self):
+    if self._features_indexer is None:
+        self._features_indexer = TransformDatasetFeatureIndexer(self)
+    return self._features_indexer
+
+
 def cd_features_length(self):
     """
     Args:
@@ -507,15 +1278,19 @@ def install_features_indexer():
 
     DatasetMixin.features_length = dm_features_length
     DatasetMixin.extract_feature_by_slice = dm_extract_feature_by_slice
+    DatasetMixin.extract_feature_by_indices = dm_extract_feature_by_indices
     DatasetMixin.extract_feature = dm_extract_feature
     DatasetMixin.preprocess_extract_feature = dm_preprocess_extract_feature
     DatasetMixin.postprocess_extract_feature = dm_postprocess_extract_feature
 
+    ConcatenatedDataset.features = cd_features
     ConcatenatedDataset.features_length = cd_features_length
     ImageDataset.features_length = id_features_length
     LabeledImageDataset.extract_feature = lid_extract_feature
     LabeledImageDataset.features_length = lid_features_length
+    SubDataset.features = sd_features
     SubDataset.features_length = sd_features_length
+    TransformDataset.features = trd_features
     TransformDataset.features_length = trd_features_length
 
 
@@ -2,6 +2,10 @@ class ExtractBySliceNotSupportedError(Exception):
     pass
 
 
+class ExtractByIndicesNotSupportedError(Exception):
+    pass
+
+
 class BaseIndexer(object):
     """Base class for Indexer"""
 
@@ -0,0 +1,119 @@
+import numpy
+import six
+
+
+class RaggedArray(object):
+
+    """Array of variable length arrays stored in one flat array
+
+    `i`-th array is ``values[offsets[i]:offsets[i + 1]]``, which is similar
+    to the CSR format of sparse matrix. It is used for the feature whose
+    length is different for each data, instead of numpy object array.
+
+    Accessing by int returns the view of `values`, and accessing by slice
+    (step 1) returns `RaggedArray` which shares `values`. Accessing by list,
+    numpy array or other slice gathers the arrays to new `RaggedArray`.
+
+    Args:
+        values (numpy.ndarray): arrays concatenated along axis 0
+        offsets (numpy.ndarray): 1d int array of length ``len(self) + 1``
+
+    .. admonition:: Example
+
+       >>> ra = RaggedArray.from_list([[1, 2, 3], [4], [5, 6]])
+       >>> print(ra[0])
+       [1 2 3]
+       >>> print(ra[[2, 1]].to_list())
+       [array([5, 6]), array([4])]
+
+    """
+
+    def __init__(self, values, offsets):
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        if offsets.ndim != 1 or len(offsets) == 0:
+            raise ValueError('offsets must be non-empty 1d array')
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, arrays, dtype=None):
+        """Creates `RaggedArray` from list of arrays
+
+        Args:
+            arrays (list): arrays whose shape are same except axis 0
+            dtype: dtype of `values`
+
+        Returns (RaggedArray):
+
+        """
+        arrays = [numpy.asarray(a, dtype=dtype) for a in arrays]
+        lengths = [len(a) for a in arrays]
+        offsets = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        if len(arrays) == 0:
+            values = numpy.empty(0, dtype=dtype)
+        else:
+            values = numpy.concatenate(arrays)
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def lengths(self):
+        """1d array of the length of each array"""
+        return numpy.diff(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                offsets = self.offsets[start:stop + 1]
+                values = self.values[offsets[0]:offsets[-1]]
+                return RaggedArray(values, offsets - offsets[0])
+            index = numpy.arange(start, stop, step)
+        elif isinstance(index, (list, numpy.ndarray)):
+            index = numpy.asarray(index)
+            if index.dtype == numpy.bool_:
+                if len(index) != len(self):
+                    raise IndexError('boolean index length {} does not '
+                                     'match {}'.format(len(index), len(self)))
+                index = numpy.flatnonzero(index)
+        else:
+            # assuming index is int
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('index {} is out of bounds for size {}'
+                                 .format(index, len(self)))
+            return self.values[self.offsets[index]:self.offsets[index + 1]]
+        return self._take(index)
+
+    def _take(self, indices):
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        indices = numpy.where(indices < 0, indices + len(self), indices)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        # position in `values` of each element of the gathered arrays
+        positions = numpy.repeat(starts - offsets[:-1], lengths) + \
+            numpy.arange(offsets[-1])
+        return RaggedArray(self.values[positions], offsets)
+
+    def __iter__(self):
+        for i in six.moves.range(len(self)):
+            yield self[i]
+
+    def to_list(self):
+        """Returns list of arrays, each of them is the view of `values`"""
+        return list(self)
+
+    def __repr__(self):
+        return 'RaggedArray(len={}, values={})'.format(
+            len(self), repr(self.values))
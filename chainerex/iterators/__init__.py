@@ -1,2 +1,3 @@
 from chainerex.iterators.balanced_serial_iterator import BalancedSerialIterator  # NOQA
 from chainerex.iterators.balanced_serial_iterator import IndexIterator  # NOQA
+from chainerex.iterators.multiprocess_balanced_iterator import MultiprocessBalancedIterator  # NOQA
@@ -1,18 +1,134 @@
 from __future__ import division
 
 import numpy
+import six
 
 from chainer.dataset import iterator
+from chainer import serializer as serializer_module
+from chainer.datasets import TupleDataset
 
 
-class IndexIterator(iterator.Iterator):
+def _get_fetch_columns(dataset):
+    """Returns numpy arrays of `dataset` which support fancy indexing, or None
+
+    Args:
+        dataset: dataset to fetch examples
+
+    Returns: numpy array if `dataset` is numpy array, tuple of numpy arrays if
+        `dataset` is `TupleDataset` of numpy arrays, otherwise None.
+
     """
-    
-    IndexIterator is used internally in `BalancedSerialIterator`, as each 
-    label's index iterator 
+    if isinstance(dataset, numpy.ndarray):
+        return dataset
+    if isinstance(dataset, TupleDataset) and all(
+            isinstance(d, numpy.ndarray) for d in dataset._datasets):
+        return dataset._datasets
+    return None
+
+
+def _fetch_examples(dataset, columns, indices):
+    """Fetch examples of `indices` as list
+
+    When `columns` is given, examples are fetched by one fancy indexing for
+    each array instead of accessing the dataset for each example.
+
+    Args:
+        dataset: dataset to fetch examples
+        columns: returned value of `_get_fetch_columns(dataset)`
+        indices (numpy.ndarray): 1d ndarray of indices
+
+    Returns (list): examples
+
     """
+    if columns is None:
+        return [dataset[index] for index in indices]
+    elif isinstance(columns, numpy.ndarray):
+        return list(columns[indices])
+    else:
+        return list(six.moves.zip(*[d[indices] for d in columns]))
 
-    def __init__(self, index_list, shuffle=True, num=0):
+
+def _allocate_counts(weights, total):
+    """Allocates `total` to each element proportional to `weights`
+
+    The largest remainder method is used so that the sum of the returned
+    counts is exactly `total`.
+
+    Args:
+        weights (numpy.ndarray): 1d array of non-negative weights
+        total (int): total count to allocate
+
+    Returns (numpy.ndarray): 1d int array of counts
+
+    """
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    if weights.size == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if numpy.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError('weights must be non-negative and at least one '
+                         'weight must be positive, got {}'.format(weights))
+    quota = weights / weights.sum() * total
+    counts = numpy.floor(quota).astype(numpy.int64)
+    rest = int(total - counts.sum())
+    if rest > 0:
+        # stable sort keeps the result deterministic for tie
+        order = numpy.argsort(-(quota - counts), kind='mergesort')
+        counts[order[:rest]] += 1
+    return counts
+
+
+def _get_rng_state(rng):
+    """Returns the state of `numpy.random.Generator` as uint64 array
+
+    Only the PCG64 bit generator, which is used by
+    `numpy.random.default_rng`, is supported. The array is
+    ``[state_hi, state_lo, inc_hi, inc_lo, has_uint32, uinteger]``, so that
+    it can be saved by any serializer.
+    """
+    state = rng.bit_generator.state
+    if state['bit_generator'] != 'PCG64':
+        raise ValueError('bit generator {} is not supported'
+                         .format(state['bit_generator']))
+    mask = (1 << 64) - 1
+    s, inc = state['state']['state'], state['state']['inc']
+    return numpy.array([s >> 64, s & mask, inc >> 64, inc & mask,
+                        state['has_uint32'], state['uinteger']],
+                       dtype=numpy.uint64)
+
+
+def _set_rng_state(rng, rng_state):
+    """Restores the state of `rng` returned by `_get_rng_state`"""
+    v = [int(x) for x in rng_state]
+    rng.bit_generator.state = {
+        'bit_generator': 'PCG64',
+        'state': {'state': (v[0] << 64) | v[1], 'inc': (v[2] << 64) | v[3]},
+        'has_uint32': v[4],
+        'uinteger': v[5],
+    }
+
+
+def _serialize_rng(serializer, rng):
+    rng_state = serializer('rng_state', _get_rng_state(rng))
+    if isinstance(serializer, serializer_module.Deserializer):
+        _set_rng_state(rng, rng_state)
+
+
+class IndexIterator(iterator.Iterator):
+    """Iterator of the index list, which is shuffled when it is exhausted
+
+    `BalancedSerialIterator` uses `_LabelIndexStore`, which iterates the
+    index list of each label in the same way with this class.
+
+    Args:
+        index_list: 1d array of indices.
+        shuffle (bool): If ``True``, the index list is shuffled every time
+            it is exhausted.
+        num (int): Number of indices returned by `next`.
+        rng (numpy.random.Generator): Random number generator owned by this
+            iterator. A new generator is created by default.
+    """
+
+    def __init__(self, index_list, shuffle=True, num=0, rng=None):
         self.index_list = numpy.asarray(index_list)
         assert self.index_list.ndim == 1
         self.index_length = len(index_list)
@@ -20,12 +136,13 @@ class IndexIterator(iterator.Iterator):
         self.current_pos = 0
         self.shuffle = shuffle
         self.num = num
+        self.rng = numpy.random.default_rng() if rng is None else rng
 
         self.update_current_index_list()
 
     def update_current_index_list(self):
         if self.shuffle:
-            self.current_index_list = numpy.random.permutation(self.index_list)
+            self.current_index_list = self.rng.permutation(self.index_list)
         else:
             self.current_index_list = self.index_list
 
@@ -72,6 +189,184 @@ class IndexIterator(iterator.Iterator):
         self.current_index_list = serializer('current_index_list',
                                              self.current_index_list)
         self.current_pos = serializer('current_pos', self.current_pos)
+        _serialize_rng(serializer, self.rng)
+
+
+class _LabelIndexStore(object):
+    """Indices of each label stored in one compact array
+
+    Indices of the examples are grouped by label with one stable argsort,
+    which is O(N log N) regardless of the number of labels. The group `g`
+    occupies ``[offsets[g], offsets[g + 1])`` of the index arrays, and each
+    group is iterated in the same way as `IndexIterator`.
+
+    Each group is shuffled from the sorted indices, and the state of the
+    random number generator used for it is kept in `group_rng_states`. Thus
+    `current_order` can be regenerated from O(number of labels) values, see
+    `get_compact_state`.
+
+    Args:
+        labels (numpy.ndarray): 1d array of labels, can be `numpy.memmap`.
+        shuffle (bool): If ``True``, indices of each group are shuffled
+            every time the group is exhausted.
+        rng (numpy.random.Generator): Random number generator to shuffle.
+            A new generator is created by default.
+        indices (numpy.ndarray): 1d array of the indices of the examples of
+            `labels`. ``arange(len(labels))`` is used by default.
+
+    """
+
+    def __init__(self, labels, shuffle=True, rng=None, indices=None):
+        order = numpy.argsort(labels, kind='mergesort')
+        sorted_labels = labels[order]
+        if indices is None:
+            sorted_indices = order
+        else:
+            sorted_indices = numpy.asarray(indices)[order]
+        boundaries = numpy.flatnonzero(
+            sorted_labels[1:] != sorted_labels[:-1]) + 1
+        self.offsets = numpy.concatenate(
+            [[0], boundaries, [len(sorted_labels)]]).astype(numpy.int64)
+        self.unique_labels = sorted_labels[self.offsets[:-1]]
+        self.sorted_indices = sorted_indices
+        self.current_order = sorted_indices.copy()
+        self.positions = numpy.zeros(len(self.unique_labels),
+                                     dtype=numpy.int64)
+        self.shuffle = shuffle
+        self.rng = numpy.random.default_rng() if rng is None else rng
+        self.group_rng_states = numpy.zeros((len(self.unique_labels), 6),
+                                            dtype=numpy.uint64)
+        # incremented whenever `current_order` is modified in place
+        self._version = 0
+        self._snapshot = None
+        self._snapshot_version = -1
+        if shuffle:
+            for group in six.moves.range(len(self.unique_labels)):
+                self._shuffle_group(group)
+
+    def __len__(self):
+        return len(self.unique_labels)
+
+    def count(self, group):
+        return int(self.offsets[group + 1] - self.offsets[group])
+
+    def _shuffle_group(self, group, rng=None):
+        start, end = self.offsets[group], self.offsets[group + 1]
+        current = self.current_order[start:end]
+        current[...] = self.sorted_indices[start:end]
+        if rng is None:
+            rng = self.rng
+            self.group_rng_states[group] = _get_rng_state(rng)
+        rng.shuffle(current)
+        self._version += 1
+
+    def get_next_indices(self, group, num):
+        """get next `num` indices of `group`, same with `IndexIterator`"""
+        start, end = self.offsets[group], self.offsets[group + 1]
+        length = end - start
+        pos = self.positions[group]
+        current = self.current_order[start:end]
+        if pos + num < length:
+            self.positions[group] = pos + num
+            return current[pos:pos + num].copy()
+
+        indices = [current[pos:].copy()]
+        num -= length - pos
+        q, r = divmod(num, length)
+        indices.append(numpy.tile(self.sorted_indices[start:end], q))
+        if self.shuffle:
+            self._shuffle_group(group)
+        indices.append(current[:r].copy())
+        self.positions[group] = r
+        return numpy.concatenate(indices)
+
+    def get_state(self):
+        """Returns snapshot of `current_order`, `positions` and rng states
+
+        `current_order` is copied only when it is modified after the last
+        snapshot.
+        """
+        if self._snapshot_version != self._version:
+            self._snapshot = self.current_order.copy()
+            self._snapshot_version = self._version
+        return (self._snapshot, self.positions.copy(),
+                self.group_rng_states.copy())
+
+    def set_state(self, state):
+        current_order, positions, group_rng_states = state
+        self.current_order[...] = current_order
+        self.positions[...] = positions
+        self.group_rng_states[...] = group_rng_states
+        self._version += 1
+
+    def append(self, indices, labels):
+        """Appends `indices` of `labels` at the end of each group
+
+        Groups which gain indices are shuffled again and their positions are
+        reset, when `shuffle` is ``True``.
+        """
+        order = numpy.argsort(labels, kind='mergesort')
+        indices = indices[order].astype(self.sorted_indices.dtype)
+        labels = labels[order]
+        unique_labels = numpy.union1d(self.unique_labels, labels)
+
+        # insert at the end of the group, or between the groups for new label
+        ends = self.offsets[numpy.searchsorted(self.unique_labels, labels,
+                                               side='right')]
+        self.sorted_indices = numpy.insert(self.sorted_indices, ends, indices)
+        self.current_order = numpy.insert(self.current_order, ends, indices)
+
+        old_groups = numpy.searchsorted(unique_labels, self.unique_labels)
+        new_labels, new_counts = numpy.unique(labels, return_counts=True)
+        new_groups = numpy.searchsorted(unique_labels, new_labels)
+        counts = numpy.zeros(len(unique_labels), dtype=numpy.int64)
+        counts[old_groups] = numpy.diff(self.offsets)
+        counts[new_groups] += new_counts
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        self.unique_labels = unique_labels
+
+        positions = numpy.zeros(len(unique_labels), dtype=numpy.int64)
+        positions[old_groups] = self.positions
+        self.positions = positions
+        group_rng_states = numpy.zeros((len(unique_labels), 6),
+                                       dtype=numpy.uint64)
+        group_rng_states[old_groups] = self.group_rng_states
+        self.group_rng_states = group_rng_states
+        self._version += 1
+        if self.shuffle:
+            for group in new_groups:
+                self._shuffle_group(group)
+                self.positions[group] = 0
+
+    def get_compact_state(self):
+        """Returns `positions` and `group_rng_states` without `current_order`
+        """
+        return self.positions.copy(), self.group_rng_states.copy()
+
+    def set_compact_state(self, state):
+        """Regenerates `current_order` from `get_compact_state` values"""
+        positions, group_rng_states = state
+        self.positions[...] = positions
+        self.group_rng_states[...] = group_rng_states
+        if self.shuffle:
+            rng = numpy.random.default_rng()
+            for group in six.moves.range(len(self.unique_labels)):
+                _set_rng_state(rng, self.group_rng_states[group])
+                self._shuffle_group(group, rng=rng)
+
+    def serialize(self, serializer):
+        if isinstance(serializer, serializer_module.Deserializer):
+            # loaded in place
+            serializer('current_order', self.current_order)
+            serializer('positions', self.positions)
+            serializer('group_rng_states', self.group_rng_states)
+            self._version += 1
+        else:
+            # copy, since the arrays are modified in place after serialized
+            current_order, positions, group_rng_states = self.get_state()
+            serializer('current_order', current_order)
+            serializer('positions', positions)
+            serializer('group_rng_states', group_rng_states)
 
 
 class BalancedSerialIterator(iterator.Iterator):
@@ -99,12 +394,52 @@ class BalancedSerialIterator(iterator.Iterator):
         shuffle (bool): If ``True``, the order of examples is shuffled at the
             beginning of each epoch. Otherwise, examples are extracted in the
             order of indexes.
+        batch_balancing (bool): If ``True``, each minibatch is composed of
+            the labels with the same rate as one epoch, instead of slicing
+            the order of one epoch. The number of examples of each label in
+            a minibatch is the floor of its quota, and the remainders are
+            assigned randomly by the fractional part of the quotas. Examples
+            are generated for each minibatch, thus the order of one epoch is
+            not stored.
+        label_cap (int): If specified, the number of samples of each
+            included label in one epoch is capped at `label_cap`, i.e.,
+            ``min(count, label_cap)``. Major labels are undersampled and
+            minor labels are sampled as they are.
+        alpha (float): If specified, each label is sampled proportional to
+            ``count ** (1 - alpha)`` in one epoch, i.e., each example is
+            weighted by inverse-frequency to the power of `alpha`.
+            ``alpha=0`` keeps the original label distribution and ``alpha=1``
+            samples each label equally.
+        label_weights (dict): If specified, each label is sampled
+            proportional to ``label_weights[label]`` in one epoch. Labels
+            not in the dict are not sampled.
+        epoch_size (int): Number of examples in one epoch for `alpha` and
+            `label_weights` mode. The number of examples of included labels
+            is used by default.
+        rank (int): Rank of this process in the data parallel training.
+        world_size (int): Number of processes in the data parallel training.
+            Every rank computes the same order of one epoch with `seed`, and
+            takes the disjoint part ``order[rank::world_size]`` of it. The
+            order is padded by its head to be divisible by `world_size`.
+        seed (int): Seed of `numpy.random.Generator` owned by this
+            iterator, whose state is saved by `serialize`. If None, it is
+            seeded by the OS entropy. It must be same in all ranks when
+            `world_size` is larger than 1.
+        compact_snapshot (bool): If ``True``, `serialize` saves only the
+            positions and random number generator states at the beginning
+            of the current epoch, whose size is O(number of labels), instead
+            of the order of examples. The order is regenerated on load.
+
+    When none of `label_cap`, `alpha` and `label_weights` is specified, each
+    included label is oversampled up to the count of the major label.
 
     """
 
     def __init__(self, dataset, batch_size, labels, repeat=True, shuffle=True,
-                 batch_balancing=False, ignore_labels=None):
-        assert len(dataset) == len(labels)
+                 batch_balancing=False, ignore_labels=None, label_cap=None,
+                 alpha=None, label_weights=None, epoch_size=None, rank=0,
+                 world_size=1, seed=None, compact_snapshot=False):
+        # `numpy.asarray` and `numpy.ravel` do not copy `numpy.memmap`
         labels = numpy.asarray(labels)
         if len(dataset) != labels.size:
             raise ValueError('dataset length {} and labels size {} must be '
@@ -116,6 +451,7 @@ class BalancedSerialIterator(iterator.Iterator):
         self.dataset = dataset
         self.batch_size = batch_size
         self.labels = labels
+        self._fetch_columns = _get_fetch_columns(dataset)
 
         if ignore_labels is None:
             ignore_labels = []
@@ -126,51 +462,165 @@ class BalancedSerialIterator(iterator.Iterator):
         self._shuffle = shuffle
         self._batch_balancing = batch_balancing
 
-        self.labels_iterator_dict = {}
+        if world_size < 1 or not 0 <= rank < world_size:
+            raise ValueError('rank {} and world_size {} are invalid.'
+                             .format(rank, world_size))
+        if world_size > 1 and seed is None:
+            raise ValueError('seed must be specified when world_size > 1, '
+                             'to compute same order in all ranks.')
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self._rng = numpy.random.default_rng(seed)
+        self.compact_snapshot = compact_snapshot
+        # state to regenerate the order of the current epoch
+        self._epoch_start_state = None
+
+        self._label_index = _LabelIndexStore(labels, shuffle=shuffle,
+                                             rng=self._rng)
+        # list of (indices, labels) appended during the current epoch
+        self._pending_appends = []
+        self.label_cap = label_cap
+        self.alpha = alpha
+        self.label_weights = label_weights
+        self.epoch_size = epoch_size
+        self._update_label_stats()
+        self.reset()
 
-        max_label_count = -1
-        include_label_count = 0
-        for label in numpy.unique(labels):
-            label_index = numpy.argwhere(labels == label).ravel()
-            # print('label', label, )
-            label_count = len(label_index)
-            ii = IndexIterator(label_index, shuffle=shuffle)
-            self.labels_iterator_dict[label] = ii
-            if label in self.ignore_labels:
-                continue
-            # --- below only for included labels ---
-            if max_label_count < label_count:
-                max_label_count = label_count
-            include_label_count += 1
+    def _update_label_stats(self):
+        """Computes the number of samples of each label from label index"""
+        self.label_list = list(self._label_index.unique_labels)
+        self._include_groups = [
+            group for group, label in enumerate(self.label_list)
+            if label not in self.ignore_labels]
 
+        max_label_count = -1
+        for group in self._include_groups:
+            max_label_count = max(max_label_count,
+                                  self._label_index.count(group))
         self.max_label_count = max_label_count
-        self.N_augmented = max_label_count * include_label_count
-        self.reset()
+        self.label_sample_counts = self._compute_label_sample_counts()
+        total = sum(self.label_sample_counts.values())
+        if total <= 0:
+            raise ValueError('No example is sampled in one epoch, check '
+                             'ignore_labels and sampling options.')
+        # Number of examples of one epoch in this rank
+        self.N_augmented = -(-total // self.world_size)
+        self._label_rates = numpy.array(
+            [self.label_sample_counts[self.label_list[group]]
+             for group in self._include_groups],
+            dtype=numpy.float64) / total
+
+    def append(self, indices, labels):
+        """Appends examples to be sampled from the next epoch
+
+        The examples are added to the index pool of each label at the next
+        epoch boundary (or `reset`), and the number of samples of each label
+        and `N_augmented` are updated there. Only the appended labels are
+        processed, the whole label array is not scanned again.
+
+        The caller must extend the dataset to contain `indices`, or replace
+        `dataset` attribute by the dataset which contains them (e.g. new
+        `TupleDataset`, whose arrays can not grow). The arrays used to fetch
+        examples are taken from `dataset` again when the examples are added.
+        The `labels` attribute is not updated. Appended examples which are
+        not applied yet are also serialized, and they are applied at the next
+        epoch boundary after resume. A snapshot is loaded to the iterator
+        constructed with the dataset and labels including all the appended
+        examples, whether they are applied or not.
+
+        Args:
+            indices: 1d array of indices of the examples in the dataset.
+            labels: 1d array of labels of the examples.
+
+        """
+        indices = numpy.ravel(numpy.asarray(indices))
+        labels = numpy.ravel(numpy.asarray(labels))
+        if indices.size != labels.size:
+            raise ValueError('indices size {} and labels size {} must be '
+                             'same!'.format(indices.size, labels.size))
+        if indices.size > 0:
+            self._pending_appends.append((indices, labels))
+
+    def _apply_appends(self):
+        if not self._pending_appends:
+            return
+        indices = numpy.concatenate([i for i, _ in self._pending_appends])
+        labels = numpy.concatenate([l for _, l in self._pending_appends])
+        self._pending_appends = []
+        # `dataset` may be replaced by the caller to contain `indices`
+        self._fetch_columns = _get_fetch_columns(self.dataset)
+        if indices.max() >= len(self.dataset):
+            raise IndexError('appended index {} is out of the dataset of '
+                             'length {}'.format(indices.max(),
+                                                len(self.dataset)))
+        self._label_index.append(indices, labels)
+        self._update_label_stats()
+
+    def _compute_label_sample_counts(self):
+        """Returns dict of the number of samples of each label in one epoch"""
+        n_modes = sum(option is not None for option in
+                      (self.label_cap, self.alpha, self.label_weights))
+        if n_modes > 1:
+            raise ValueError('Only one of label_cap, alpha and label_weights '
+                             'can be specified.')
+        if self.epoch_size is not None and self.alpha is None and \
+                self.label_weights is None:
+            raise ValueError('epoch_size can be specified only with alpha or '
+                             'label_weights.')
+
+        include_labels = [self.label_list[group]
+                          for group in self._include_groups]
+        label_counts = numpy.array(
+            [self._label_index.count(group)
+             for group in self._include_groups], dtype=numpy.float64)
+
+        if self.label_cap is not None:
+            if self.label_cap <= 0:
+                raise ValueError('label_cap must be positive, got {}'
+                                 .format(self.label_cap))
+            counts = numpy.minimum(label_counts, self.label_cap)
+        elif self.alpha is not None or self.label_weights is not None:
+            if self.alpha is not None:
+                weights = label_counts ** (1. - self.alpha)
+            else:
+                weights = [self.label_weights.get(label, 0.)
+                           for label in include_labels]
+            epoch_size = self.epoch_size
+            if epoch_size is None:
+                epoch_size = int(label_counts.sum())
+            counts = _allocate_counts(weights, epoch_size)
+        else:
+            counts = [self.max_label_count] * len(include_labels)
+        return {label: int(count)
+                for label, count in zip(include_labels, counts)}
 
     def __next__(self):
         if not self._repeat and self.epoch > 0:
             raise StopIteration
 
+        return self._fetch(self._next_indices())
+
+    def _next_indices(self):
+        """Returns indices of next batch, and updates the iteration state"""
+        if self._batch_balancing:
+            return self._next_balanced_indices()
         self._previous_epoch_detail = self.epoch_detail
 
         i = self.current_position
         i_end = i + self.batch_size
         N = self.N_augmented
 
-        batch = [self.dataset[index] for index in self._order[i:i_end]]
+        indices = self._order[i:i_end]
 
         if i_end >= N:
             if self._repeat:
                 rest = i_end - N
+                self._apply_appends()
                 self._update_order()
-                # if self._order is not None:
-                #     numpy.random.shuffle(self._order)
                 if rest > 0:
-                    # if self._order is None:
-                    #     batch.extend(self.dataset[:rest])
-                    # else:
-                    batch.extend([self.dataset[index]
-                                  for index in self._order[:rest]])
+                    indices = numpy.concatenate(
+                        [indices, self._order[:rest]])
                 self.current_position = rest
             else:
                 self.current_position = 0
@@ -181,10 +631,62 @@ class BalancedSerialIterator(iterator.Iterator):
             self.is_new_epoch = False
             self.current_position = i_end
 
-        return batch
+        return indices
+
+    def _next_balanced_indices(self):
+        self._previous_epoch_detail = self.epoch_detail
+
+        i = self.current_position
+        i_end = i + self.batch_size
+        N = self.N_augmented
+        batch_size = self.batch_size
+
+        if i_end >= N:
+            if self._repeat:
+                self.current_position = i_end - N
+            else:
+                batch_size = N - i
+                self.current_position = 0
+            self.epoch += 1
+            self.is_new_epoch = True
+        else:
+            self.is_new_epoch = False
+            self.current_position = i_end
+
+        indices = self._generate_balanced_batch(batch_size)
+        if self.is_new_epoch:
+            self._apply_appends()
+        return indices
+
+    def _generate_balanced_batch(self, batch_size):
+        """Returns indices of one minibatch composed by the label quotas"""
+        # All ranks generate the same minibatch of `world_size` times size.
+        total = batch_size * self.world_size
+        quota = self._label_rates * total
+        counts = numpy.floor(quota).astype(numpy.int64)
+        rest = int(total - counts.sum())
+        if rest > 0:
+            frac = quota - counts
+            chosen = self._rng.choice(len(frac), rest, replace=False,
+                                      p=frac / frac.sum())
+            counts[chosen] += 1
+
+        indices_list = [
+            self._label_index.get_next_indices(group, count)
+            for group, count in zip(self._include_groups, counts)
+            if count > 0]
+        indices = numpy.concatenate(indices_list)
+        if self._shuffle:
+            indices = self._rng.permutation(indices)
+        if self.world_size > 1:
+            indices = indices[self.rank::self.world_size]
+        return indices
 
     next = __next__
 
+    def _fetch(self, indices):
+        return _fetch_examples(self.dataset, self._fetch_columns, indices)
+
     @property
     def epoch_detail(self):
         return self.epoch + self.current_position / self.N_augmented
@@ -195,39 +697,140 @@ class BalancedSerialIterator(iterator.Iterator):
             return None
         return self._previous_epoch_detail
 
+    def _get_state(self):
+        """Returns the snapshot of the iteration state
+
+        `order` is not copied, since it is replaced instead of modified in
+        place during the iteration.
+        """
+        return {
+            'current_position': self.current_position,
+            'epoch': self.epoch,
+            'is_new_epoch': self.is_new_epoch,
+            'previous_epoch_detail': self._previous_epoch_detail,
+            'order': self._order,
+            'label_index': self._label_index.get_state(),
+            'rng_state': _get_rng_state(self._rng),
+            'epoch_start_state': self._epoch_start_state,
+        }
+
+    def _set_state(self, state):
+        """Restores the iteration state returned by `_get_state`"""
+        self.current_position = state['current_position']
+        self.epoch = state['epoch']
+        self.is_new_epoch = state['is_new_epoch']
+        self._previous_epoch_detail = state['previous_epoch_detail']
+        self._order = state['order']
+        self._label_index.set_state(state['label_index'])
+        _set_rng_state(self._rng, state['rng_state'])
+        self._epoch_start_state = state['epoch_start_state']
+
     def serialize(self, serializer):
+        # label index must be rebuilt before its state is loaded
+        self._serialize_pending_appends(serializer['pending_appends'])
         self.current_position = serializer('current_position',
                                            self.current_position)
         self.epoch = serializer('epoch', self.epoch)
         self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
-        if self._order is not None:
-            serializer('order', self._order)
+        if not self.compact_snapshot:
+            if self._order is not None:
+                serializer('order', self._order)
+            self._label_index.serialize(serializer['label_index'])
+            _serialize_rng(serializer, self._rng)
         self._previous_epoch_detail = serializer(
             'previous_epoch_detail', self._previous_epoch_detail)
 
-        for label, index_iterator in self.labels_iterator_dict.items():
-            # self.labels_iterator_dict[label] = serializer(
-            #     'index_iterator_{}'.format(label),
-            #     self.labels_iterator_dict[label]
-            # )
-            self.labels_iterator_dict[label].serialize(
-                serializer['index_iterator_{}'.format(label)])
+        is_deserializer = isinstance(serializer,
+                                     serializer_module.Deserializer)
+        if self._batch_balancing:
+            # The order is generated for each batch, thus the current states
+            # are enough to resume.
+            if self.compact_snapshot:
+                state = self._serialize_generator_state(
+                    serializer['generator'],
+                    (_get_rng_state(self._rng),
+                     self._label_index.get_compact_state()))
+                if is_deserializer:
+                    self._set_generator_state(state)
+        else:
+            state = self._serialize_generator_state(
+                serializer['epoch_start'], self._epoch_start_state)
+            if is_deserializer and self.compact_snapshot:
+                # Replay `_update_order` of the current epoch
+                self._set_generator_state(state)
+                self._update_order()
+
+    def _serialize_pending_appends(self, serializer):
+        if not isinstance(serializer, serializer_module.Deserializer):
+            if self._pending_appends:
+                indices = numpy.concatenate(
+                    [i for i, _ in self._pending_appends])
+                labels = numpy.concatenate(
+                    [l for _, l in self._pending_appends])
+            else:
+                indices = numpy.empty(0, dtype=numpy.int64)
+                labels = numpy.empty(0, dtype=self.labels.dtype)
+            serializer('indices', indices)
+            serializer('labels', labels)
+            return
+
+        indices = numpy.asarray(serializer('indices', None))
+        labels = numpy.asarray(serializer('labels', None))
+        self._pending_appends = []
+        if indices.size == 0:
+            return
+        # Label index of the snapshot does not contain pending examples,
+        # while this iterator is constructed with the labels of all of them.
+        applied = numpy.ones(len(self.labels), dtype=numpy.bool_)
+        applied[indices[indices < len(self.labels)]] = False
+        self._label_index = _LabelIndexStore(
+            self.labels[applied], shuffle=self._shuffle, rng=self._rng,
+            indices=numpy.flatnonzero(applied))
+        self._update_label_stats()
+        if not self._batch_balancing:
+            # same length with the order of the snapshot
+            self._update_order()
+        self._pending_appends.append((indices, labels))
+
+    @staticmethod
+    def _serialize_generator_state(serializer, state):
+        """Serializes the rng state and compact label index state"""
+        rng_state, (positions, group_rng_states) = state
+        # copy, since the state may be shared with `_get_state` snapshots
+        rng_state = serializer('rng_state', rng_state.copy())
+        positions = serializer('positions', positions.copy())
+        group_rng_states = serializer('group_rng_states',
+                                      group_rng_states.copy())
+        return rng_state, (positions, group_rng_states)
+
+    def _set_generator_state(self, state):
+        rng_state, label_index_state = state
+        self._label_index.set_compact_state(label_index_state)
+        _set_rng_state(self._rng, rng_state)
 
     def _update_order(self):
+        self._epoch_start_state = (_get_rng_state(self._rng),
+                                   self._label_index.get_compact_state())
         indices_list = []
-        for label, index_iterator in self.labels_iterator_dict.items():
-            if label in self.ignore_labels:
-                # Not include index of ignore_labels
-                continue
-            indices_list.append(index_iterator.get_next_indices(
-                self.max_label_count))
-            # print('key, value = ', key, value)
+        for group in self._include_groups:
+            label = self.label_list[group]
+            indices_list.append(self._label_index.get_next_indices(
+                group, self.label_sample_counts[label]))
 
         indices = numpy.concatenate(indices_list).ravel()
-        self._order = numpy.random.permutation(indices)
+        order = self._rng.permutation(indices)
+        if self.world_size > 1:
+            pad = self.N_augmented * self.world_size - len(order)
+            order = numpy.concatenate([order, order[:pad]])
+            order = order[self.rank::self.world_size]
+        self._order = order
 
     def reset(self):
-        self._update_order()
+        self._apply_appends()
+        if self._batch_balancing:
+            self._order = None
+        else:
+            self._update_order()
         self.current_position = 0
         self.epoch = 0
         self.is_new_epoch = False
@@ -236,18 +839,14 @@ class BalancedSerialIterator(iterator.Iterator):
         self._previous_epoch_detail = -1.
 
     def show_label_stats(self):
-        print('   label    count     rate     status')
-        total = 0
-        for label, index_iterator in self.labels_iterator_dict.items():
-            count = len(index_iterator.index_list)
-            total += count
-
-        for label, index_iterator in self.labels_iterator_dict.items():
-            count = len(index_iterator.index_list)
+        print('   label    count     rate     status  sampled')
+        for group, label in enumerate(self.label_list):
+            count = self._label_index.count(group)
             rate = count / len(self.dataset)
             status = 'ignored' if label in self.ignore_labels else 'included'
-            print('{:>8} {:>8} {:>8.4f} {:>10}'
-                  .format(label, count, rate, status))
+            sampled = self.label_sample_counts.get(label, 0)
+            print('{:>8} {:>8} {:>8.4f} {:>10} {:>8}'
+                  .format(label, count, rate, status, sampled))
 
 
 if __name__ == '__main__':
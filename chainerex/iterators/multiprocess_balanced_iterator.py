@@ -0,0 +1,243 @@
+from __future__ import division
+
+import collections
+import multiprocessing
+
+import numpy
+
+from chainer.dataset import iterator
+from chainer import serializer as serializer_module
+
+from chainerex.iterators.balanced_serial_iterator import BalancedSerialIterator  # NOQA
+from chainerex.iterators.balanced_serial_iterator import _fetch_examples
+from chainerex.iterators.balanced_serial_iterator import _get_fetch_columns
+
+
+# Global variables in the worker process, set by `_fetch_setup`
+_fetch_dataset = None
+_fetch_columns = None
+_fetch_mem = None
+
+
+def _fetch_setup(dataset, mem):
+    global _fetch_dataset, _fetch_columns, _fetch_mem
+    _fetch_dataset = dataset
+    _fetch_columns = _get_fetch_columns(dataset)
+    _fetch_mem = mem
+
+
+def _fetch_run(args):
+    indices, offset, limit = args
+    batch = _fetch_examples(_fetch_dataset, _fetch_columns, indices)
+    if _fetch_mem is not None:
+        packed = []
+        for example in batch:
+            example, offset = _pack(example, _fetch_mem, offset, limit)
+            packed.append(example)
+        batch = packed
+    return batch
+
+
+class _PackedNdarray(object):
+    """ndarray stored in the shared memory, only metadata is pickled"""
+
+    def __init__(self, array, mem, offset):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.size = array.size
+        self.nbytes = array.nbytes
+        self.offset = offset
+        target = numpy.frombuffer(mem, self.dtype, self.size, self.offset)
+        target[...] = array.ravel()
+
+    def unpack(self, mem):
+        ret = numpy.frombuffer(mem, self.dtype, self.size, self.offset)
+        # Copy, since the shared memory is reused by following batches.
+        return ret.reshape(self.shape).copy()
+
+
+def _pack(example, mem, offset, limit):
+    """Pack ndarrays of `example` into `mem` from `offset`.
+
+    ndarrays which do not fit in `limit` are left as they are, and pickled.
+    Returns the packed example and the offset for the next example.
+    """
+    if isinstance(example, tuple):
+        ret = []
+        for v in example:
+            v, offset = _pack(v, mem, offset, limit)
+            ret.append(v)
+        return tuple(ret), offset
+    elif isinstance(example, numpy.ndarray) and \
+            offset + example.nbytes <= limit:
+        packed = _PackedNdarray(example, mem, offset)
+        return packed, offset + packed.nbytes
+    return example, offset
+
+
+def _unpack(example, mem):
+    if isinstance(example, tuple):
+        return tuple(_unpack(v, mem) for v in example)
+    elif isinstance(example, _PackedNdarray):
+        return example.unpack(mem)
+    return example
+
+
+class MultiprocessBalancedIterator(iterator.Iterator):
+
+    """Multiprocess version of `BalancedSerialIterator`.
+
+    The order of examples is same with `BalancedSerialIterator`, which is
+    computed in the main process, while the examples are loaded by the worker
+    processes. Up to `n_prefetch` batches are loaded in advance, so that
+    expensive `get_example` (e.g. image decode and augmentation) does not
+    stall the training.
+
+    It serializes the state of the consumed batches, not the prefetched
+    ones, thus it resumes exactly same with `BalancedSerialIterator`.
+
+    Args:
+        dataset: Dataset to iterate.
+        batch_size (int): Number of examples within each batch.
+        labels: Labels of each example, see `BalancedSerialIterator`.
+        repeat (bool): If ``True``, it infinitely loops over the dataset.
+            Otherwise, it stops iteration at the end of the first epoch.
+        shuffle (bool): If ``True``, the order of examples is shuffled.
+        n_processes (int): Number of worker processes. The number of CPUs is
+            used by default.
+        n_prefetch (int): Number of batches loaded in advance.
+        shared_mem (int): Size of the shared memory in bytes per batch.
+            ndarrays of examples are transferred through the shared memory
+            instead of pickling, when they fit in this size. If None, shared
+            memory is not used.
+        **kwargs: Other arguments of `BalancedSerialIterator`.
+
+    """
+
+    def __init__(self, dataset, batch_size, labels, repeat=True, shuffle=True,
+                 n_processes=None, n_prefetch=1, shared_mem=None, **kwargs):
+        self._pool = None
+        self._mem = None
+        self._queue = collections.deque()
+        self._slot = 0
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self._repeat = repeat
+        self.n_processes = n_processes or multiprocessing.cpu_count()
+        self.n_prefetch = max(n_prefetch, 1)
+        self.shared_mem = shared_mem
+
+        # Used only to compute the order of examples.
+        self._order_iterator = BalancedSerialIterator(
+            dataset, batch_size, labels, repeat=repeat, shuffle=shuffle,
+            **kwargs)
+        self._state = self._order_iterator._get_state()
+
+    def __next__(self):
+        if not self._repeat and self.epoch > 0:
+            raise StopIteration
+        if self._pool is None:
+            self._start_pool()
+        self._prefetch()
+        if len(self._queue) == 0:
+            raise StopIteration
+        result, state = self._queue.popleft()
+        batch = []
+        for sub_batch in result.get():
+            batch.extend(sub_batch)
+        if self._mem is not None:
+            batch = [_unpack(example, self._mem) for example in batch]
+        self._state = state
+        return batch
+
+    next = __next__
+
+    def _start_pool(self):
+        if self.shared_mem is not None:
+            self._mem = multiprocessing.RawArray(
+                'b', self.shared_mem * self.n_prefetch)
+        self._pool = multiprocessing.Pool(
+            self.n_processes, initializer=_fetch_setup,
+            initargs=(self.dataset, self._mem))
+
+    def _prefetch(self):
+        order_iterator = self._order_iterator
+        while len(self._queue) < self.n_prefetch:
+            if not self._repeat and order_iterator.epoch > 0:
+                break
+            indices = order_iterator._next_indices()
+            # Each prefetched batch uses its own slot of the shared memory,
+            # and the slot is split for each worker.
+            n_split = max(min(self.n_processes, len(indices)), 1)
+            slot_size = self.shared_mem or 0
+            split_size = slot_size // n_split
+            offset = self._slot * slot_size
+            self._slot = (self._slot + 1) % self.n_prefetch
+            tasks = [(sub_indices, offset + i * split_size,
+                      offset + (i + 1) * split_size)
+                     for i, sub_indices in
+                     enumerate(numpy.array_split(indices, n_split))]
+            result = self._pool.map_async(_fetch_run, tasks, chunksize=1)
+            self._queue.append((result, order_iterator._get_state()))
+
+    def _clear_queue(self):
+        # Wait for the running tasks, which may write to the shared memory.
+        for result, _ in self._queue:
+            result.wait()
+        self._queue.clear()
+
+    @property
+    def epoch(self):
+        return self._state['epoch']
+
+    @property
+    def is_new_epoch(self):
+        return self._state['is_new_epoch']
+
+    @property
+    def current_position(self):
+        return self._state['current_position']
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + self.current_position / \
+            self._order_iterator.N_augmented
+
+    @property
+    def previous_epoch_detail(self):
+        if self._state['previous_epoch_detail'] < 0:
+            return None
+        return self._state['previous_epoch_detail']
+
+    def serialize(self, serializer):
+        order_iterator = self._order_iterator
+        producer_state = order_iterator._get_state()
+        # Serialize the state of consumed batch.
+        order_iterator._set_state(self._state)
+        order_iterator.serialize(serializer)
+        if isinstance(serializer, serializer_module.Deserializer):
+            # Prefetched batches are discarded, restart from loaded state.
+            self._state = order_iterator._get_state()
+            self._clear_queue()
+        else:
+            order_iterator._set_state(producer_state)
+
+    def reset(self):
+        self._order_iterator.reset()
+        self._state = self._order_iterator._get_state()
+        self._clear_queue()
+
+    def show_label_stats(self):
+        self._order_iterator.show_label_stats()
+
+    def finalize(self):
+        """Terminates the worker processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._queue.clear()
+
+    def __del__(self):
+        self.finalize()
@@ -2,12 +2,23 @@
 from chainerex.utils.aggregate import aggregate_json  # NOQA
 from chainerex.utils.aggregate import aggregate_log  # NOQA
 from chainerex.utils.aggregate import merge_json_and_log  # NOQA
+from chainerex.utils.cache import LazyNpzDatasets  # NOQA
 from chainerex.utils.cache import cache_load_npz  # NOQA
+from chainerex.utils.cache import cache_load_npz_sharded  # NOQA
+from chainerex.utils.cache import cache_load_npy_dir  # NOQA
+from chainerex.utils.cache import cache_load_npy_dir_sharded  # NOQA
 from chainerex.utils.cache import cache_load_pandas_hdf5  # NOQA
+from chainerex.utils.cache import clear_memo  # NOQA
+from chainerex.utils.cache import compute_cache_hash  # NOQA
+from chainerex.utils.cache import iter_npy_dir_chunks  # NOQA
+from chainerex.utils.cache import iter_pandas_hdf5_chunks  # NOQA
 from chainerex.utils.cache import load_npz  # NOQA
+from chainerex.utils.cache import load_npy_dir  # NOQA
 from chainerex.utils.cache import load_pandas_hdf5  # NOQA
 from chainerex.utils.cache import save_npz  # NOQA
+from chainerex.utils.cache import save_npy_dir  # NOQA
 from chainerex.utils.cache import save_pandas_hdf5  # NOQA
+from chainerex.utils.cache import set_memo_max_bytes  # NOQA
 from chainerex.utils.create_timedir import create_timedir  # NOQA
 from chainerex.utils.filesys import collect_files  # NOQA
 from chainerex.utils.filesys import walk_all_files  # NOQA
@@ -1,108 +1,1033 @@
 """
 Use `cache_load_npz` if `preprocess_fn` return numpy array data. 
 Use `cache_load_pandas_hdf5` if `preprocess_fn` return pandas Series/DataFrame.
+Use `cache_load_npy_dir` if `preprocess_fn` return numpy array data and the
+cache should be opened as memory-map, which is shared between processes.
+
+Pass `content_hash=True` to `cache_load_*` to key the cache file by the hash of
+`preprocess_fn` and its arguments, so that one cache directory can be shared
+by many experiments without loading stale data.
+
+`cache_load_*` can be called for the same path from multiple processes at
+once, only one process runs `preprocess_fn` and the others wait for it.
 """
+import collections
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import multiprocessing
 import os
+import pickle
+import shutil
+import struct
+import sys
 
 import numpy
 import pandas
+import six
 import time
 
+from chainer.datasets import ConcatenatedDataset
+from chainer.datasets import TupleDataset
+
+try:
+    import scipy.sparse as scipy_sparse
+except ImportError:
+    scipy_sparse = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
 
 def _check_path_exist(filepath):
     if not os.path.exists(filepath):
         raise IOError('{} not found'.format(filepath))
 
 
-def save_npz(filepath, datasets):
+NPZ_STRUCTURE_KEY = '__structure__'
+
+_SPARSE_ARRAY_NAMES = {'csr': ('data', 'indices', 'indptr'),
+                       'csc': ('data', 'indices', 'indptr'),
+                       'coo': ('data', 'row', 'col')}
+
+
+def _is_sparse(d):
+    return scipy_sparse is not None and scipy_sparse.issparse(d)
+
+
+def _is_structured(datasets):
+    return any(isinstance(d, (dict, tuple)) or _is_sparse(d)
+               for d in datasets)
+
+
+def _flatten(d, key, arrays):
+    """Flatten nested dict/tuple `d` into `arrays`, returns its structure."""
+    if isinstance(d, dict):
+        items = []
+        for k, v in d.items():
+            if not isinstance(k, six.string_types):
+                raise TypeError('dict key must be str, but got {}'
+                                .format(type(k)))
+            if '/' in k:
+                # e.g. {'a/b': x} and {'a': {'b': y}} are saved to same key
+                raise ValueError("dict key must not contain '/', but got {}"
+                                 .format(k))
+            items.append([k, _flatten(v, key + '/' + k, arrays)])
+        return {'type': 'dict', 'items': items}
+    elif isinstance(d, tuple):
+        return {'type': 'tuple',
+                'items': [_flatten(v, '{}/{}'.format(key, i), arrays)
+                          for i, v in enumerate(d)]}
+    elif _is_sparse(d):
+        sparse_format = d.format if d.format in _SPARSE_ARRAY_NAMES else 'csr'
+        if sparse_format != d.format:
+            d = d.tocsr()
+        for name in _SPARSE_ARRAY_NAMES[sparse_format]:
+            arrays[key + '/' + name] = getattr(d, name)
+        return {'type': 'sparse', 'format': sparse_format, 'key': key,
+                'shape': list(d.shape)}
+    else:
+        arrays[key] = d
+        return {'type': 'array', 'key': key}
+
+
+def _unflatten(structure, get_array):
+    node_type = structure['type']
+    if node_type == 'dict':
+        return collections.OrderedDict(
+            (k, _unflatten(v, get_array)) for k, v in structure['items'])
+    elif node_type == 'tuple':
+        return tuple(_unflatten(v, get_array) for v in structure['items'])
+    elif node_type == 'sparse':
+        if scipy_sparse is None:
+            raise ImportError('scipy is required to load sparse matrix')
+        key = structure['key']
+        names = _SPARSE_ARRAY_NAMES[structure['format']]
+        data, index0, index1 = [get_array(key + '/' + name)
+                                for name in names]
+        shape = tuple(structure['shape'])
+        if structure['format'] == 'coo':
+            return scipy_sparse.coo_matrix((data, (index0, index1)),
+                                           shape=shape)
+        matrix_class = getattr(scipy_sparse,
+                               '{}_matrix'.format(structure['format']))
+        return matrix_class((data, index0, index1), shape=shape)
+    else:
+        return get_array(structure['key'])
+
+
+def _load_npz_structure(npz):
+    """Returns list of structures of each dataset, or None for legacy file"""
+    if NPZ_STRUCTURE_KEY not in npz.files:
+        return None
+    return json.loads(str(npz[NPZ_STRUCTURE_KEY]))
+
+
+def save_npz(filepath, datasets, compress=False):
+    """Save datasets in '.npz' format
+
+    Each dataset is saved as `arr_{i}`. Datasets may be nested dict/tuple of
+    numpy arrays and `scipy.sparse` matrices, in this case they are flattened
+    to the arrays named by the key path (e.g. 'arr_0/x' for `datasets[0]['x']`)
+    and the structure is saved together, so that they are restored without
+    pickling. Dict keys must be str which does not contain '/'. Sparse
+    matrices are saved in its native compact layout, e.g. 'data', 'indices'
+    and 'indptr' for CSR matrix.
+
+    Args:
+        filepath (str): filepath to save datasets
+        datasets (numpy.ndarray, dict or tuple): datasets to save
+        compress (bool): If True, `numpy.savez_compressed` is used, which
+            reduces the file size with the cost of save/load time.
+
+    """
+    if inspect.isgenerator(datasets):
+        raise TypeError('save_npz does not support chunked datasets, '
+                        'use save_npy_dir or save_pandas_hdf5 instead.')
     if not isinstance(datasets, (list, tuple)):
         datasets = (datasets, )
-    numpy.savez(filepath, *datasets)
+    savez = numpy.savez_compressed if compress else numpy.savez
+    if _is_structured(datasets):
+        arrays = {}
+        structure = [_flatten(d, 'arr_{}'.format(i), arrays)
+                     for i, d in enumerate(datasets)]
+        arrays[NPZ_STRUCTURE_KEY] = numpy.array(json.dumps(structure))
+        with open(filepath, 'wb') as f:
+            savez(f, **arrays)
+        return
+    # Pass file object, so that '.npz' extension is not appended to filepath.
+    with open(filepath, 'wb') as f:
+        savez(f, *datasets)
 
 
-def load_npz(filepath):
-    _check_path_exist(filepath)
-    load_data = numpy.load(filepath)
-    result = []
+def _count_npz_arrays(keys):
     i = 0
-    while True:
-        key = 'arr_{}'.format(i)
-        if key in load_data.keys():
-            result.append(load_data[key])
-            i += 1
+    while 'arr_{}'.format(i) in keys:
+        i += 1
+    return i
+
+
+class LazyNpzDatasets(object):
+    """Lazy sequence of the datasets saved by `save_npz`
+
+    Each dataset is read from the archive only when it is first indexed, and
+    kept afterwards. The file handle is kept open until `close` is called,
+    it can be also used with `with` statement.
+
+    .. admonition:: Example
+
+       >>> with load_npz('data.npz', lazy=True) as datasets:
+       ...     x = datasets[0]  # only `arr_0` is read
+
+    Args:
+        filepath (str): filepath saved by `save_npz`
+
+    """
+
+    def __init__(self, filepath):
+        _check_path_exist(filepath)
+        self._npz = numpy.load(filepath)
+        self._structure = _load_npz_structure(self._npz)
+        if self._structure is None:
+            self._length = _count_npz_arrays(set(self._npz.files))
+        else:
+            self._length = len(self._structure)
+        self._arrays = {}
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in
+                    range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('index {} is out of range for {} arrays'
+                             .format(index, self._length))
+        if index not in self._arrays:
+            if self._npz is None:
+                raise ValueError('{} is already closed'
+                                 .format(self.__class__.__name__))
+            if self._structure is None:
+                self._arrays[index] = self._npz['arr_{}'.format(index)]
+            else:
+                self._arrays[index] = _unflatten(self._structure[index],
+                                                 self._npz.__getitem__)
+        return self._arrays[index]
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
+
+    def close(self):
+        """Close the file handle, arrays already read are still kept."""
+        if self._npz is not None:
+            self._npz.close()
+            self._npz = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_npz(filepath, lazy=False):
+    """Load datasets saved by `save_npz`
+
+    Args:
+        filepath (str): filepath saved by `save_npz`
+        lazy (bool): If True, `LazyNpzDatasets` is returned and each dataset
+            is read only when it is accessed.
+
+    Returns: dataset, list of datasets or `LazyNpzDatasets`
+
+    """
+    if lazy:
+        return LazyNpzDatasets(filepath)
+    _check_path_exist(filepath)
+    with numpy.load(filepath) as load_data:
+        structure = _load_npz_structure(load_data)
+        if structure is None:
+            num_arrays = _count_npz_arrays(set(load_data.files))
+            result = [load_data['arr_{}'.format(i)]
+                      for i in range(num_arrays)]
         else:
-            break
+            result = [_unflatten(s, load_data.__getitem__)
+                      for s in structure]
     if len(result) == 1:
         result = result[0]
     return result
 
 
-def save_pandas_hdf5(filepath, datasets):
+def save_pandas_hdf5(filepath, datasets, complib=None, complevel=None,
+                     format=None, data_columns=None):
+    """Save datasets in HDF5 format by `pandas.HDFStore`
+
+    Args:
+        filepath (str): filepath to save datasets
+        datasets (Series/DataFrame, tuple or generator): datasets to save
+        complib (str or None): compression library of `pandas.HDFStore`,
+            e.g. 'zlib', 'blosc', 'blosc:lz4'. If None, not compressed.
+        complevel (int or None): compression level, 0-9.
+        format (str or None): 'fixed' or 'table'. 'table' format supports
+            to read only selected columns/rows from the disk, see
+            `load_pandas_hdf5`. If None, 'fixed' is used except for chunked
+            datasets, which are always saved in 'table' format.
+        data_columns (list or True or None): columns which can be used in
+            `where` condition of `load_pandas_hdf5`, only for 'table'
+            format. True to use all columns.
+
+    """
+    if inspect.isgenerator(datasets):
+        _save_pandas_hdf5_chunks(filepath, datasets, complib=complib,
+                                 complevel=complevel,
+                                 data_columns=data_columns)
+        return
     if not isinstance(datasets, (list, tuple)):
         datasets = (datasets, )
 
-    store = pandas.HDFStore(filepath)
-    for i, d in enumerate(datasets):
-        store['arr_{}'.format(i)] = d
-    store.close()
+    store = pandas.HDFStore(filepath, complib=complib, complevel=complevel)
+    try:
+        for i, d in enumerate(datasets):
+            if format == 'table':
+                store.put('arr_{}'.format(i), d, format='table',
+                          data_columns=_data_columns(d, data_columns))
+            else:
+                store.put('arr_{}'.format(i), d, format=format)
+    finally:
+        store.close()
 
 
-def load_pandas_hdf5(filepath):
-    _check_path_exist(filepath)
-    load_store = pandas.HDFStore(filepath)
-    result = []
+def _data_columns(d, data_columns):
+    # Series does not have data columns.
+    return data_columns if isinstance(d, pandas.DataFrame) else None
+
+
+def _save_pandas_hdf5_chunks(filepath, chunks, complib=None, complevel=None,
+                             data_columns=None):
+    # Chunks are appended to 'table' format, which is growable on disk.
+    store = pandas.HDFStore(filepath, complib=complib, complevel=complevel)
+    try:
+        for chunk in chunks:
+            if not isinstance(chunk, (list, tuple)):
+                chunk = (chunk, )
+            for i, d in enumerate(chunk):
+                store.append('arr_{}'.format(i), d,
+                             data_columns=_data_columns(d, data_columns))
+    finally:
+        store.close()
+
+
+def _count_hdf5_arrays(keys):
     i = 0
-    while True:
-        key = '/arr_{}'.format(i)
-        if key in load_store.keys():
-            result.append(load_store[key])
-            i += 1
-        else:
-            break
+    while '/arr_{}'.format(i) in keys:
+        i += 1
+    return i
+
+
+def _select_kwargs(store, key, columns, coordinates):
+    kwargs = {}
+    pandas_kind = store.get_storer(key).pandas_kind
+    if columns is not None and pandas_kind == 'frame':
+        raise ValueError('columns can not be selected from {} of {}, it must '
+                         "be saved in 'table' format.".format(key,
+                                                              store.filename))
+    if columns is not None and pandas_kind == 'frame_table':
+        # Columns can not be selected from Series
+        kwargs['columns'] = columns
+    if coordinates is not None:
+        kwargs['where'] = coordinates
+    return kwargs
+
+
+def _select_coordinates(store, where):
+    # `where` is evaluated on 'arr_0', and same rows are selected from all
+    # the datasets, since data columns of 'arr_0' may not exist in others.
+    if where is None:
+        return None
+    return store.select_as_coordinates('arr_0', where=where)
+
+
+def load_pandas_hdf5(filepath, columns=None, where=None, chunksize=None):
+    """Load datasets saved by `save_pandas_hdf5`
+
+    `columns` and `where` are only supported for the datasets saved in
+    'table' format, ValueError is raised for `columns` of DataFrame saved in
+    'fixed' format. The selection is done on the disk so that only the
+    selected data is read into the memory.
+
+    Args:
+        filepath (str): filepath saved by `save_pandas_hdf5`
+        columns (list or None): columns to read, only applied to DataFrame
+            datasets. If None, all columns are read.
+        where (str, list or None): condition to select rows, e.g.
+            'index < 1000' or 'a > 0' for data column 'a'. It is evaluated on
+            the first dataset, and the same rows are selected from all the
+            datasets.
+        chunksize (int or None): If specified, generator of chunks is
+            returned, see `iter_pandas_hdf5_chunks`.
+
+    Returns: pandas Series/DataFrame dataset, or list of them
+
+    """
+    if chunksize is not None:
+        return iter_pandas_hdf5_chunks(filepath, chunksize, columns=columns,
+                                       where=where)
+    _check_path_exist(filepath)
+    load_store = pandas.HDFStore(filepath, mode='r')
+    try:
+        num_arrays = _count_hdf5_arrays(load_store.keys())
+        coordinates = _select_coordinates(load_store, where)
+        result = []
+        for i in range(num_arrays):
+            key = 'arr_{}'.format(i)
+            if columns is None and where is None:
+                result.append(load_store[key])
+            else:
+                result.append(load_store.select(
+                    key, **_select_kwargs(load_store, key, columns,
+                                          coordinates)))
+    finally:
+        load_store.close()
     if len(result) == 1:
         result = result[0]
-    load_store.close()
     return result
 
 
-def _cache_load_base(save_fn, load_fn, filepath, preprocess_fn, *args,
-                     **kwargs):
+def iter_pandas_hdf5_chunks(filepath, chunksize, columns=None, where=None):
+    """Iterate datasets saved by `save_pandas_hdf5` chunk by chunk
+
+    Only the datasets saved in 'table' format, e.g. saved from chunks, can be
+    read by chunks.
+
+    Args:
+        filepath (str): filepath saved by `save_pandas_hdf5`
+        chunksize (int): number of rows for each chunk
+        columns (list or None): columns to read, see `load_pandas_hdf5`.
+        where (str, list or None): condition to select rows, see
+            `load_pandas_hdf5`.
+
+    Returns: generator which yields Series/DataFrame, or tuple of them
+
     """
-    
+    _check_path_exist(filepath)
+    store = pandas.HDFStore(filepath, mode='r')
+    try:
+        num_arrays = _count_hdf5_arrays(store.keys())
+        coordinates = _select_coordinates(store, where)
+        iterators = []
+        for i in range(num_arrays):
+            key = 'arr_{}'.format(i)
+            iterators.append(store.select(
+                key, chunksize=chunksize,
+                **_select_kwargs(store, key, columns, coordinates)))
+        for chunk in six.moves.zip(*iterators):
+            yield chunk[0] if len(chunk) == 1 else chunk
+    finally:
+        store.close()
+
+
+NPY_DIR_MANIFEST = 'manifest.json'
+
+
+def save_npy_dir(dirpath, datasets):
+    """Save datasets as a directory of raw '.npy' files with a manifest
+
+    Each array is saved as 'arr_{i}.npy' under `dirpath`, and the
+    'manifest.json' file is written at last to mark the directory complete.
+
+    `datasets` may be a generator which yields chunks of the datasets, in this
+    case each chunk is appended to the files on disk and concatenated along
+    the first axis, so that datasets larger than the memory can be saved.
+
+    Args:
+        dirpath (str): directory path to save datasets
+        datasets (numpy.ndarray, tuple or generator): datasets to save
+
+    """
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    if inspect.isgenerator(datasets):
+        arrays = _save_npy_dir_chunks(dirpath, datasets)
+    else:
+        if not isinstance(datasets, (list, tuple)):
+            datasets = (datasets, )
+        arrays = []
+        for i, d in enumerate(datasets):
+            d = numpy.asarray(d)
+            filename = 'arr_{}.npy'.format(i)
+            numpy.save(os.path.join(dirpath, filename), d, allow_pickle=False)
+            arrays.append({'file': filename, 'shape': list(d.shape),
+                           'dtype': d.dtype.str})
+    with open(os.path.join(dirpath, NPY_DIR_MANIFEST), 'w') as f:
+        json.dump({'format': 'npy_dir', 'arrays': arrays}, f, indent=4)
+
+
+def _npy_header(dtype, shape, header_length=None):
+    """Returns '.npy' format version 1.0 header.
+
+    The header is padded to `header_length`, so that it can be rewritten in
+    place after the data is appended.
+    """
+    header = repr({'descr': numpy.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False,
+                   'shape': tuple(shape)}).encode('latin1')
+    if header_length is None:
+        # 10 bytes are for magic string, version and header length field,
+        # the data starts from the 64 bytes aligned position.
+        header_length = -(-(10 + len(header) + 1) // 64) * 64 - 10
+    padding = header_length - len(header) - 1
+    if padding < 0:
+        raise ValueError('npy header is too long for shape {}'.format(shape))
+    return (numpy.lib.format.magic(1, 0) + struct.pack('<H', header_length)
+            + header + b' ' * padding + b'\n')
+
+
+def _save_npy_dir_chunks(dirpath, chunks):
+    files = None
+    arrays = None
+    try:
+        for chunk in chunks:
+            if not isinstance(chunk, (list, tuple)):
+                chunk = (chunk, )
+            chunk = [numpy.ascontiguousarray(d) for d in chunk]
+            if files is None:
+                # Reserve the header which is long enough for any length.
+                files = []
+                arrays = []
+                for i, d in enumerate(chunk):
+                    filename = 'arr_{}.npy'.format(i)
+                    f = open(os.path.join(dirpath, filename), 'wb')
+                    files.append(f)
+                    header = _npy_header(
+                        d.dtype, (sys.maxsize, ) + d.shape[1:])
+                    f.write(header)
+                    arrays.append({'file': filename, 'shape': list(d.shape),
+                                   'dtype': d.dtype.str,
+                                   'header_length': len(header) - 10})
+                    d.tofile(f)
+                continue
+            if len(chunk) != len(arrays):
+                raise ValueError('number of arrays in chunk changed from {} '
+                                 'to {}'.format(len(arrays), len(chunk)))
+            for f, a, d in zip(files, arrays, chunk):
+                if d.dtype.str != a['dtype'] or \
+                        list(d.shape[1:]) != a['shape'][1:]:
+                    raise ValueError(
+                        'chunk of {} has dtype {} and shape {}, which does '
+                        'not match with dtype {} and shape {}'.format(
+                            a['file'], d.dtype, d.shape[1:], a['dtype'],
+                            tuple(a['shape'][1:])))
+                d.tofile(f)
+                a['shape'][0] += len(d)
+        if files is None:
+            raise ValueError('preprocess_fn yields no chunk')
+        # Rewrite header with actual shape
+        for f, a in zip(files, arrays):
+            f.seek(0)
+            f.write(_npy_header(numpy.dtype(a['dtype']), a['shape'],
+                                header_length=a.pop('header_length')))
+    finally:
+        if files is not None:
+            for f in files:
+                f.close()
+    return arrays
+
+
+def load_npy_dir(dirpath, mmap_mode='r'):
+    """Load datasets saved by `save_npy_dir`
+
+    With `mmap_mode='r'` (default), arrays are opened as read-only memory-map
+    without copying, so that processes loading the same cache on one host
+    share the page cache.
+
+    Args:
+        dirpath (str): directory path saved by `save_npy_dir`
+        mmap_mode (str or None): `mmap_mode` of `numpy.load`. If None, arrays
+            are loaded into memory.
+
+    Returns: numpy array, or list of numpy arrays
+
+    """
+    manifest_path = os.path.join(dirpath, NPY_DIR_MANIFEST)
+    _check_path_exist(manifest_path)
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    result = [numpy.load(os.path.join(dirpath, a['file']),
+                         mmap_mode=mmap_mode, allow_pickle=False)
+              for a in manifest['arrays']]
+    if len(result) == 1:
+        result = result[0]
+    return result
+
+
+def iter_npy_dir_chunks(dirpath, chunksize):
+    """Iterate datasets saved by `save_npy_dir` chunk by chunk
+
+    Each chunk is a view of the read-only memory-map, thus only the chunk
+    being accessed is read into the memory.
+
+    Args:
+        dirpath (str): directory path saved by `save_npy_dir`
+        chunksize (int): number of rows for each chunk
+
+    Returns: generator which yields numpy array, or list of numpy arrays
+
+    """
+    datasets = load_npy_dir(dirpath, mmap_mode='r')
+    if not isinstance(datasets, list):
+        datasets = [datasets]
+    length = len(datasets[0])
+    for start in six.moves.range(0, length, chunksize):
+        chunk = [d[start:start + chunksize] for d in datasets]
+        yield chunk[0] if len(chunk) == 1 else chunk
+
+
+def _remove_cache(filepath):
+    if os.path.isdir(filepath):
+        shutil.rmtree(filepath)
+    else:
+        os.remove(filepath)
+
+
+def _update_hash_by_function(h, fn):
+    if hasattr(fn, 'func'):
+        # functools.partial, bound arguments are part of the key.
+        _update_hash_by_function(h, fn.func)
+        _update_hash_by_object(h, (fn.args, sorted(fn.keywords.items())))
+        return
+    try:
+        h.update(inspect.getsource(fn).encode('utf-8'))
+    except (IOError, OSError, TypeError):
+        # Source is not available (e.g. defined in interactive shell),
+        # use bytecode instead.
+        code = getattr(fn, '__code__', None)
+        if code is None:
+            h.update(repr(fn).encode('utf-8'))
+        else:
+            h.update(code.co_code)
+            h.update(repr(code.co_consts).encode('utf-8'))
+
+
+def _update_hash_by_object(h, obj):
+    try:
+        h.update(pickle.dumps(obj, protocol=2))
+    except Exception:
+        # Not picklable (e.g. lambda), `repr` is the best effort.
+        h.update(repr(obj).encode('utf-8'))
+
+
+def compute_cache_hash(preprocess_fn, *args, **kwargs):
+    """Compute the cache key of `preprocess_fn` called with `args`, `kwargs`.
+
+    The key is computed from the source code (or bytecode when the source is
+    not available) of `preprocess_fn` and its arguments. Note that the
+    functions or global variables referred by `preprocess_fn` are not
+    taken into account.
+
     Args:
-        save_fn (callable): save dataset function 
-        load_fn (callable): load dataset function
-        filepath (str): filepath to cache dataset
         preprocess_fn (callable): dataset preparation function
         *args: args for `preprocess_fn`
         **kwargs: kwargs for `preprocess_fn`
 
-    Returns: dataset
+    Returns (str): hex digest of sha1 hash
 
     """
-    SLEEP_TIME = 3  # 3sec
+    h = hashlib.sha1()
+    _update_hash_by_function(h, preprocess_fn)
+    _update_hash_by_object(h, (args, sorted(kwargs.items())))
+    return h.hexdigest()
+
+
+def _hash_filepath(filepath, cache_hash):
+    root, ext = os.path.splitext(filepath)
+    return '{}_{}{}'.format(root, cache_hash[:16], ext)
+
+
+def _meta_filepath(filepath):
+    return filepath + '.meta.json'
+
+
+def _check_meta(filepath, cache_hash):
+    meta_filepath = _meta_filepath(filepath)
+    if not os.path.exists(meta_filepath):
+        return False
+    try:
+        with open(meta_filepath, 'r') as f:
+            meta = json.load(f)
+    except ValueError:
+        # broken metadata, treat as mismatch.
+        return False
+    return meta.get('hash') == cache_hash
+
+
+def _save_meta(filepath, cache_hash, preprocess_fn):
+    meta = {'hash': cache_hash,
+            'preprocess_fn': getattr(preprocess_fn, '__name__',
+                                     repr(preprocess_fn)),
+            'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(_meta_filepath(filepath), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+class _MemoCache(object):
+    """LRU cache of loaded datasets with the byte-size budget"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self._data:
+            return None
+        # Move to the end as the most recently used one
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value[0]
+
+    def put(self, key, dataset, nbytes):
+        if key in self._data:
+            self.current_bytes -= self._data.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return
+        self.evict(self.max_bytes - nbytes)
+        self._data[key] = (dataset, nbytes)
+        self.current_bytes += nbytes
+
+    def evict(self, max_bytes):
+        # Evict least recently used datasets until fit in `max_bytes`
+        while self.current_bytes > max_bytes:
+            _, (_, evicted_nbytes) = self._data.popitem(last=False)
+            self.current_bytes -= evicted_nbytes
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+
+_memo_cache = _MemoCache(max_bytes=1024 ** 3)
+
+
+def set_memo_max_bytes(max_bytes):
+    """Set the byte-size budget of the in-process memo of `cache_load_*`
+
+    Least recently used datasets are evicted when the budget is exceeded.
+
+    Args:
+        max_bytes (int): budget in bytes, default is 1GiB.
+
+    """
+    _memo_cache.max_bytes = max_bytes
+    _memo_cache.evict(max_bytes)
+
+
+def clear_memo():
+    """Clear the in-process memo of `cache_load_*`"""
+    _memo_cache.clear()
+
+
+def _memo_nbytes(dataset):
+    """Returns memory size of `dataset`, or None if it can not be memoized."""
+    if isinstance(dataset, (list, tuple, dict)):
+        values = dataset.values() if isinstance(dataset, dict) else dataset
+        nbytes = [_memo_nbytes(d) for d in values]
+        return None if None in nbytes else sum(nbytes)
+    elif _is_sparse(dataset):
+        return sum(getattr(dataset, name).nbytes
+                   for name in _SPARSE_ARRAY_NAMES[dataset.format])
+    elif isinstance(dataset, numpy.memmap):
+        # Not in the memory, only the mapping is kept.
+        return 0
+    elif isinstance(dataset, numpy.ndarray):
+        return dataset.nbytes
+    elif isinstance(dataset, (pandas.Series, pandas.DataFrame)):
+        return int(numpy.sum(dataset.memory_usage(deep=True)))
+    else:
+        # e.g. `LazyNpzDatasets` or generator
+        return None
+
+
+def _memo_readonly(dataset):
+    if isinstance(dataset, (list, tuple)):
+        return type(dataset)(_memo_readonly(d) for d in dataset)
+    elif isinstance(dataset, dict):
+        return type(dataset)((k, _memo_readonly(v))
+                             for k, v in dataset.items())
+    elif _is_sparse(dataset):
+        for name in _SPARSE_ARRAY_NAMES[dataset.format]:
+            getattr(dataset, name).flags.writeable = False
+        return dataset
+    elif isinstance(dataset, numpy.ndarray):
+        dataset.flags.writeable = False
+        return dataset
+    else:
+        return dataset
+
+
+def _memo_copy(dataset):
+    # Containers are copied so that the memo is not modified, while the
+    # arrays are shared.
+    if isinstance(dataset, (list, tuple)):
+        return type(dataset)(_memo_copy(d) for d in dataset)
+    elif isinstance(dataset, dict):
+        return type(dataset)((k, _memo_copy(v)) for k, v in dataset.items())
+    elif _is_sparse(dataset):
+        # New matrix object sharing the read-only arrays
+        return type(dataset)(dataset)
+    elif isinstance(dataset, (pandas.Series, pandas.DataFrame)):
+        # pandas object can not be made read-only, copy to protect the memo.
+        return dataset.copy()
+    else:
+        return dataset
+
+
+def _memo_key(load_fn, filepath):
+    if os.path.isdir(filepath):
+        # npy dir is published at once with its manifest
+        st = os.stat(os.path.join(filepath, NPY_DIR_MANIFEST))
+    else:
+        st = os.stat(filepath)
+    load_key = repr(load_fn)
+    if isinstance(load_fn, functools.partial):
+        load_key = (repr(load_fn.func), load_fn.args,
+                    repr(sorted(load_fn.keywords.items())))
+    return (os.path.abspath(filepath), st.st_ino, st.st_mtime, st.st_size,
+            load_key)
+
+
+def _memo_load(load_fn, filepath):
+    """Load dataset through the in-process LRU memo
+
+    The memo is keyed on the path, mtime and size of the cache file, thus the
+    re-created cache is loaded again. numpy arrays are returned as read-only
+    arrays shared with the memo, and pandas objects are returned as copies.
+    """
+    key = _memo_key(load_fn, filepath)
+    dataset = _memo_cache.get(key)
+    if dataset is None:
+        dataset = load_fn(filepath)
+        nbytes = _memo_nbytes(dataset)
+        if nbytes is None:
+            return dataset
+        dataset = _memo_readonly(dataset)
+        _memo_cache.put(key, dataset, nbytes)
+    return _memo_copy(dataset)
+
+
+@contextlib.contextmanager
+def _file_lock(lock_filepath):
+    """Exclusive inter-process lock, blocks until the lock is acquired.
+
+    The lock file is not removed after release, since removing it may break
+    the mutual exclusion with other processes waiting for the same file.
+    """
+    with open(lock_filepath, 'a') as f:
+        if fcntl is None:
+            print('[WARNING] fcntl is not available, cache is not locked.')
+        else:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def _temp_filepath(filepath):
+    dirname, basename = os.path.split(filepath)
+    return os.path.join(dirname, '.{}.tmp{}'.format(basename, os.getpid()))
+
+
+def _is_cache_ready(filepath, cache_hash):
     if not os.path.exists(filepath):
+        return False
+    return cache_hash is None or _check_meta(filepath, cache_hash)
+
+
+def _prepare_cache(save_fn, filepath, preprocess_fn, args, kwargs,
+                   cache_hash=None):
+    """Create the cache at `filepath` if it does not exist yet.
+
+    Only one process runs `preprocess_fn`, others block on the lock file
+    '<filepath>.lock' until the cache is published. The dataset is saved to
+    a temporary path first and renamed into `filepath`, so readers never see
+    a partially written cache.
+    """
+    if _is_cache_ready(filepath, cache_hash):
+        return
+    with _file_lock(filepath + '.lock'):
+        # The cache may be created by other process while waiting the lock.
+        if _is_cache_ready(filepath, cache_hash):
+            return
+        if os.path.exists(filepath):
+            print('[INFO] _cache_load_base: hash mismatch for {}, cache will '
+                  'be re-created.'.format(filepath))
+            _remove_cache(filepath)
         if preprocess_fn is None:
             raise ValueError('filepath {} does not exist, '
                              'preprocess_fn must not be None'.format(filepath))
         # Preprocess and cache(save) datasets
         print('[INFO] _cache_load_base: Preprocessing dataset...')
         datasets = preprocess_fn(*args, **kwargs)
-        if not isinstance(datasets, tuple):
+        if not isinstance(datasets, tuple) and \
+                not inspect.isgenerator(datasets):
             datasets = (datasets, )
-        save_fn(filepath, datasets)
-    # Now the datasets should be ready.
-    retry_count = 0
-    while not os.path.exists(filepath):
-        # This case may happen when `save_fn` was async method.
-        print('[WARNING] {} not found, retry in {} sec.'
-              .format(filepath, SLEEP_TIME))
-        time.sleep(SLEEP_TIME)
-        retry_count += 1
-        assert retry_count < 100, '[ERROR] {} not found after cache.'
+        temp_filepath = _temp_filepath(filepath)
+        try:
+            save_fn(temp_filepath, datasets)
+            if cache_hash is not None:
+                _save_meta(filepath, cache_hash, preprocess_fn)
+            # Atomically publish the cache.
+            os.rename(temp_filepath, filepath)
+        finally:
+            if os.path.exists(temp_filepath):
+                _remove_cache(temp_filepath)
+
+
+def _cache_load_base(save_fn, load_fn, filepath, preprocess_fn, *args,
+                     **kwargs):
+    """
+    
+    Args:
+        save_fn (callable): save dataset function 
+        load_fn (callable): load dataset function
+        filepath (str): filepath to cache dataset
+        preprocess_fn (callable): dataset preparation function
+        *args: args for `preprocess_fn`
+        **kwargs: kwargs for `preprocess_fn`. Below keys are used by this
+            function and not passed to `preprocess_fn`.
+            - content_hash (bool): If True, the hash computed by
+              `compute_cache_hash` is appended to the filename of `filepath`,
+              and a metadata sidecar file '<filepath>.meta.json' is saved.
+              Cache is re-created when the hash does not match.
+            - memo (bool): If True, loaded dataset is kept in the in-process
+              LRU memo, see `_memo_load`.
+
+    Returns: dataset
+
+    """
+    content_hash = kwargs.pop('content_hash', False)
+    memo = kwargs.pop('memo', False)
+    cache_hash = None
+    if content_hash:
+        if preprocess_fn is None:
+            raise ValueError('preprocess_fn must not be None when '
+                             'content_hash is True')
+        cache_hash = compute_cache_hash(preprocess_fn, *args, **kwargs)
+        filepath = _hash_filepath(filepath, cache_hash)
+    _prepare_cache(save_fn, filepath, preprocess_fn, args, kwargs,
+                   cache_hash=cache_hash)
+    if memo:
+        return _memo_load(load_fn, filepath)
     return load_fn(filepath)
 
 
+def _shard_filepath(filepath, shard_index, num_shards):
+    root, ext = os.path.splitext(filepath)
+    return '{}.shard{:05d}-of-{:05d}{}'.format(root, shard_index, num_shards,
+                                               ext)
+
+
+def _prepare_shard(task):
+    # Run in the worker process of `_cache_load_sharded_base`.
+    save_fn, filepath, shard_fn, shard_args, kwargs, cache_hash = task
+    _prepare_cache(save_fn, filepath, shard_fn, shard_args, kwargs,
+                   cache_hash=cache_hash)
+
+
+def _cache_load_sharded_base(save_fn, load_fn, filepath, shard_fn, num_shards,
+                             *args, **kwargs):
+    """Sharded version of `_cache_load_base`
+
+    `shard_fn(shard_index, num_shards, *args, **kwargs)` prepares
+    `shard_index`-th shard of the dataset, and each shard is cached to its own
+    file. Shards which are not cached yet are prepared in the process pool,
+    shards already cached are skipped so that partially failed run resumes.
+
+    Args:
+        save_fn (callable): save dataset function
+        load_fn (callable): load dataset function
+        filepath (str): filepath to cache dataset, shard index is appended
+            to the filename for each shard.
+        shard_fn (callable): shard preparation function. It must be
+            picklable (e.g. defined at module level) to run in the pool.
+        num_shards (int): number of shards
+        *args: args for `shard_fn`
+        **kwargs: kwargs for `shard_fn`. Below keys are used by this
+            function and not passed to `shard_fn`.
+            - content_hash (bool): see `_cache_load_base`.
+            - num_workers (int or None): number of processes in the pool.
+              If None, `os.cpu_count()` processes are used. If 1, shards are
+              prepared in this process.
+            - concat (bool): If True (default), shards are concatenated
+              along the first axis. If False, shards are exposed as one
+              `ConcatenatedDataset` of `TupleDataset` without copy.
+
+    Returns: dataset
+
+    """
+    content_hash = kwargs.pop('content_hash', False)
+    num_workers = kwargs.pop('num_workers', None)
+    concat = kwargs.pop('concat', True)
+    shard_filepaths = []
+    tasks = []
+    for shard_index in six.moves.range(num_shards):
+        shard_args = (shard_index, num_shards) + args
+        shard_filepath = _shard_filepath(filepath, shard_index, num_shards)
+        cache_hash = None
+        if content_hash:
+            if shard_fn is None:
+                raise ValueError('shard_fn must not be None when '
+                                 'content_hash is True')
+            cache_hash = compute_cache_hash(shard_fn, *shard_args, **kwargs)
+            shard_filepath = _hash_filepath(shard_filepath, cache_hash)
+        shard_filepaths.append(shard_filepath)
+        if not _is_cache_ready(shard_filepath, cache_hash):
+            tasks.append((save_fn, shard_filepath, shard_fn, shard_args,
+                          kwargs, cache_hash))
+
+    if len(tasks) > 0:
+        print('[INFO] _cache_load_sharded_base: Preprocessing {} of {} '
+              'shards...'.format(len(tasks), num_shards))
+        if num_workers == 1:
+            for task in tasks:
+                _prepare_shard(task)
+        else:
+            pool = multiprocessing.Pool(num_workers)
+            try:
+                pool.map(_prepare_shard, tasks, chunksize=1)
+                pool.close()
+            except Exception:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+    shards = []
+    for shard_filepath in shard_filepaths:
+        shard = load_fn(shard_filepath)
+        if not isinstance(shard, (list, tuple)):
+            shard = [shard]
+        shards.append(shard)
+    if concat:
+        result = [numpy.concatenate(arrays) for arrays in
+                  six.moves.zip(*shards)]
+        if len(result) == 1:
+            result = result[0]
+        return result
+    else:
+        return ConcatenatedDataset(*[TupleDataset(*shard) for shard in shards])
+
+
 def cache_load_npz(filepath, preprocess_fn, *args, **kwargs):
     """Load cached dataset if possible, otherwise create it by `preprocess_fn`
 
@@ -118,13 +1043,19 @@ def cache_load_npz(filepath, preprocess_fn, *args, **kwargs):
         preprocess_fn (callable): It must return data, whose type is numpy
             It may be None, if `filepath` is guaranteed to exist
         *args: args for `preprocess_fn`
-        **kwargs: kwargs for `preprocess_fn`
+        **kwargs: kwargs for `preprocess_fn`. `content_hash` and `memo` keys
+            are reserved, see `_cache_load_base`. `lazy` key is also
+            reserved, and passed to `load_npz` (default False). `compress`
+            key is also reserved, and passed to `save_npz` (default False).
 
-    Returns: numpy dataset
+    Returns: numpy dataset, or `LazyNpzDatasets` when `lazy` is True
 
     """
-    return _cache_load_base(save_npz, load_npz, filepath, preprocess_fn,
-                            *args, **kwargs)
+    lazy = kwargs.pop('lazy', False)
+    compress = kwargs.pop('compress', False)
+    return _cache_load_base(functools.partial(save_npz, compress=compress),
+                            functools.partial(load_npz, lazy=lazy),
+                            filepath, preprocess_fn, *args, **kwargs)
 
 
 def cache_load_pandas_hdf5(filepath, preprocess_fn, *args, **kwargs):
@@ -135,28 +1066,146 @@ def cache_load_pandas_hdf5(filepath, preprocess_fn, *args, **kwargs):
     From next time, it will simply load dataset from `filepath` thus no 
     `preprocess_fn` is never invoked.
 
-    `preprocess_fn` is expected to return pandas Series or DataFrame
+    `preprocess_fn` is expected to return pandas Series or DataFrame.
+    It may be also a generator function which yields chunks of them, in this
+    case chunks are appended to the 'table' format on disk.
 
     Args:
         filepath (str): It is recommended to have '.h5' extension.
         preprocess_fn (callable): It must return data, whose type is either 
             Series/DataFrame. It may be None, if `filepath` exists.
         *args: args for `preprocess_fn`
-        **kwargs: kwargs for `preprocess_fn`
+        **kwargs: kwargs for `preprocess_fn`. `content_hash` and `memo` keys
+            are reserved, see `_cache_load_base`. `chunksize` key is also
+            reserved, when it is specified the dataset is returned as the
+            generator of chunks (see `iter_pandas_hdf5_chunks`).
+            `columns` and `where` keys are also reserved, and passed to
+            `load_pandas_hdf5` to read only the selected columns/rows.
+            `complib`, `complevel`, `format` and `data_columns` keys are also
+            reserved, and passed to `save_pandas_hdf5`. When `format` is not
+            specified, 'table' format is used if any of `chunksize`,
+            `columns` or `where` is specified.
+
+    Returns: pandas Series/DataFrame dataset, or generator of chunks
+
+    """
+    chunksize = kwargs.pop('chunksize', None)
+    columns = kwargs.pop('columns', None)
+    where = kwargs.pop('where', None)
+    save_format = kwargs.pop('format', None)
+    if save_format is None and (chunksize is not None or columns is not None
+                                or where is not None):
+        save_format = 'table'
+    save_fn = functools.partial(save_pandas_hdf5,
+                                complib=kwargs.pop('complib', None),
+                                complevel=kwargs.pop('complevel', None),
+                                format=save_format,
+                                data_columns=kwargs.pop('data_columns', None))
+    load_fn = functools.partial(load_pandas_hdf5, columns=columns,
+                                where=where, chunksize=chunksize)
+    return _cache_load_base(save_fn, load_fn, filepath, preprocess_fn,
+                            *args, **kwargs)
+
+
+def cache_load_npy_dir(dirpath, preprocess_fn, *args, **kwargs):
+    """Load cached dataset as memory-map if possible, otherwise create it
 
-    Returns: pandas Series/DataFrame dataset
+    Works same with `cache_load_npz`, but dataset is cached as the directory
+    of raw '.npy' files (see `save_npy_dir`), and loaded as read-only
+    memory-map. Loading is done in constant time without copying the data,
+    and the page cache is shared between processes on the same host.
+
+    `preprocess_fn` may be a generator function which yields chunks of the
+    dataset, so that the dataset larger than the memory can be cached.
+
+    Args:
+        dirpath (str): directory path to cache dataset.
+        preprocess_fn (callable): It must return data, whose type is numpy
+            It may be None, if `dirpath` is guaranteed to exist
+        *args: args for `preprocess_fn`
+        **kwargs: kwargs for `preprocess_fn`. `content_hash` and `memo` keys
+            are reserved, see `_cache_load_base`. `mmap_mode` key is also
+            reserved, and passed to `load_npy_dir` (default 'r').
+            `chunksize` key is also reserved, when it is specified the
+            dataset is returned as the generator of chunks
+            (see `iter_npy_dir_chunks`).
+
+    Returns: numpy dataset, or generator of chunks
+
+    """
+    mmap_mode = kwargs.pop('mmap_mode', 'r')
+    chunksize = kwargs.pop('chunksize', None)
+    if chunksize is None:
+        load_fn = functools.partial(load_npy_dir, mmap_mode=mmap_mode)
+    else:
+        load_fn = functools.partial(iter_npy_dir_chunks, chunksize=chunksize)
+    return _cache_load_base(save_npy_dir, load_fn, dirpath, preprocess_fn,
+                            *args, **kwargs)
+
+
+def cache_load_npz_sharded(filepath, shard_fn, num_shards, *args, **kwargs):
+    """Sharded version of `cache_load_npz`
+
+    `shard_fn(shard_index, num_shards, *args, **kwargs)` must return numpy
+    data of the `shard_index`-th shard. Shards are prepared in parallel by
+    the process pool and cached to each file, see `_cache_load_sharded_base`.
+
+    .. admonition:: Example
+
+       >>> def shard_fn(shard_index, num_shards, n):
+       ...     x = numpy.arange(n)[shard_index::num_shards]
+       ...     return x, x * 2
+       >>> x, t = cache_load_npz_sharded('data.npz', shard_fn, 4, 100)
+
+    Args:
+        filepath (str): It is recommended to have '.npz' extension.
+        shard_fn (callable): It must return data of each shard, whose type
+            is numpy. It may be None, if all shards are guaranteed to exist.
+        num_shards (int): number of shards
+        *args: args for `shard_fn`
+        **kwargs: kwargs for `shard_fn`. `content_hash`, `num_workers` and
+            `concat` keys are reserved, see `_cache_load_sharded_base`.
+            `compress` key is also reserved, and passed to `save_npz`.
+
+    Returns: numpy dataset, or `ConcatenatedDataset` when `concat` is False
+
+    """
+    compress = kwargs.pop('compress', False)
+    return _cache_load_sharded_base(
+        functools.partial(save_npz, compress=compress), load_npz, filepath,
+        shard_fn, num_shards, *args, **kwargs)
+
+
+def cache_load_npy_dir_sharded(dirpath, shard_fn, num_shards, *args,
+                               **kwargs):
+    """Sharded version of `cache_load_npy_dir`
+
+    Each shard is opened as read-only memory-map, thus `concat=False` exposes
+    the shards as one dataset without loading them into the memory.
+
+    Args:
+        dirpath (str): directory path to cache dataset.
+        shard_fn (callable): It must return data of each shard, whose type
+            is numpy. It may be None, if all shards are guaranteed to exist.
+        num_shards (int): number of shards
+        *args: args for `shard_fn`
+        **kwargs: kwargs for `shard_fn`. `content_hash`, `num_workers` and
+            `concat` keys are reserved, see `_cache_load_sharded_base`.
+
+    Returns: numpy dataset, or `ConcatenatedDataset` when `concat` is False
 
     """
-    return _cache_load_base(save_pandas_hdf5, load_pandas_hdf5, filepath,
-                            preprocess_fn, *args, **kwargs)
+    return _cache_load_sharded_base(save_npy_dir, load_npy_dir, dirpath,
+                                    shard_fn, num_shards, *args, **kwargs)
 
 
 if __name__ == '__main__':
     # Demo
-    # Please remove data.npz/data.h5 after demo
+    # Please remove data.npz/data.h5/data_npy after demo
 
     # mode 1: cache_load_npz demo
     # mode 2: cache_load_pandas_hdf5 demo
+    # mode 3: cache_load_npy_dir demo
     mode = 1
 
     if mode == 1:
@@ -183,3 +1232,12 @@ if __name__ == '__main__':
         df1, df2 = cache_load_pandas_hdf5('data.h5', preprocess_fn, 3)
         print('df1', df1)
         print('df2', df2)
+    elif mode == 3:
+        # Same with mode 1, but dataset is loaded as memory-map.
+        def preprocess_fn(scale):
+            x = numpy.arange(10)
+            t = x * scale
+            return x, t
+        x, t = cache_load_npy_dir('data_npy', preprocess_fn, 3)
+        print('x', x)
+        print('t', t)